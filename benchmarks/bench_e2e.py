@@ -0,0 +1,92 @@
+"""
+End-to-end benchmark: Application.start against the offline fake put.io from fake_putio.py.
+
+    python benchmarks/bench_e2e.py --files 200 --file-size 4MB --concurrent 1 4 8 --segments 1 4
+
+Every combination of max_concurrent and max_segments syncs the same synthetic account
+into a fresh target directory, and reports scan time, items per second and bytes per
+second. Use --rate-limit to cap each download connection, so segments matter the way
+they do against put.io, and --api-latency-ms to add a round trip to each API call.
+"""
+import argparse
+import itertools
+import logging
+import tempfile
+import time
+from pathlib import Path
+
+import rich
+
+from fake_putio import FakeAccount, FakePutio, parse_size
+from putio_get import metrics
+from putio_get.config import Config
+from putio_get.core import Application, console
+
+
+def run(fake: FakePutio, args, concurrent: int, segments: int) -> dict:
+    with tempfile.TemporaryDirectory(prefix="putio-e2e-") as tmp:
+        cfg = Config(with_env=False)
+        cfg.general['api_url'] = fake.api_url
+        cfg.auth['oauth_token'] = "fake"
+        cfg.paths['target'] = Path(tmp, "target")
+        cfg.paths['target'].mkdir()
+        cfg.paths['state_file'] = Path(tmp, "state.db") if args.state else None
+        cfg.paths['session_file'] = Path(tmp, "aria2.session")
+        cfg.download['engine'] = args.engine
+        cfg.download['max_concurrent'] = concurrent
+        cfg.download['max_segments'] = segments
+        cfg.download['min_segment_size'] = args.min_segment_size
+        cfg.parse_calculated_values()
+
+        registry = metrics.registry = metrics.Registry()
+        app = Application(cfg)
+        start = time.perf_counter()
+        try:
+            app.start()
+        finally:
+            app.close()
+        elapsed = time.perf_counter() - start
+
+        scan = sum(row[3] for row in registry.summary() if row[0] == "putio_scan_seconds")
+        downloaded = registry.counters.get("putio_downloaded_bytes_total", {}).get((), 0)
+        files = sum(1 for p in cfg.paths['target'].rglob("*") if p.is_file())
+        return {"elapsed": elapsed, "scan": scan, "files": files, "bytes": downloaded}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=200, help='Files in the synthetic account, not all of them are media')
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--file-size', type=str, default="4MB")
+    parser.add_argument('--concurrent', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--segments', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--min-segment-size', type=str, default="1MB")
+    parser.add_argument('--engine', type=str, default="native", choices=['auto', 'aria2', 'native'])
+    parser.add_argument('--rate-limit', type=str, default="0", help='Per-connection download limit (e.g. 10MB), 0 for none')
+    parser.add_argument('--api-latency-ms', type=float, default=0)
+    parser.add_argument('--state', action='store_true', help='Use a state database, as the container does')
+    args = parser.parse_args()
+
+    logging.getLogger("rich").setLevel(logging.WARNING)
+    console.quiet = True
+    rich.get_console().quiet = True
+
+    started = time.perf_counter()
+    account = FakeAccount(args.files, args.depth, parse_size(args.file_size))
+    fake = FakePutio(account, api_latency=args.api_latency_ms / 1000, rate_limit=parse_size(args.rate_limit))
+    print(f"Account of {args.files} files generated in {time.perf_counter() - started:.1f} s, API at {fake.api_url}")
+    print(f"{'concurrent':>10} {'segments':>8} {'files':>6} {'scan ms':>9} {'total s':>8} {'items/s':>9} {'MB/s':>8}")
+
+    try:
+        for concurrent, segments in itertools.product(args.concurrent, args.segments):
+            r = run(fake, args, concurrent, segments)
+            print(f"{concurrent:>10} {segments:>8} {r['files']:>6} {r['scan']*1000:>9.1f} {r['elapsed']:>8.2f} "
+                  f"{r['files']/r['elapsed']:>9.1f} {r['bytes']/r['elapsed']/1024/1024:>8.1f}")
+    finally:
+        fake.close()
+
+    print(f"\nAPI requests: {dict(sorted(fake.requests.items()))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Hashing benchmark: SHA-1 throughput of existing-file verification across pool sizes.
+
+    python benchmarks/bench_hash.py --dir /mnt/target/.bench --files 16 --size 256MB --workers 1 2 4 8
+
+Files are written once and dropped from the page cache before each run where the
+platform allows it, so results reflect the disk rather than memory. Point --dir at
+the storage you want to measure.
+"""
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from putio_get.config import Config
+from putio_get.utils import sha1_file
+
+
+def drop_cache(path: Path):
+    if not hasattr(os, 'posix_fadvise'): return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def make_files(directory: Path, count: int, size: int):
+    files = []
+    chunk = os.urandom(1024 * 1024)
+    for i in range(count):
+        path = directory / f"bench_{i}.bin"
+        if not path.exists() or path.stat().st_size != size:
+            with open(path, 'wb') as f:
+                for _ in range(size // len(chunk)):
+                    f.write(chunk)
+                f.write(chunk[:size % len(chunk)])
+                f.flush()
+                os.fsync(f.fileno())
+        files.append(path)
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dir', type=str, default=None, help='Directory for the test files (default: a temp dir)')
+    parser.add_argument('--files', type=int, default=8)
+    parser.add_argument('--size', type=str, default='128MB')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--block-sizes', type=str, nargs='+', default=['1MB', '8MB'])
+    parser.add_argument('--mmap', action='store_true', help='Also measure mmap reads')
+    args = parser.parse_args()
+
+    cfg = Config(with_env=False)
+    size = cfg._parse_size(args.size)
+    block_sizes = [cfg._parse_size(b) for b in args.block_sizes]
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        files = make_files(Path(tmp), args.files, size)
+        total = size * len(files)
+        print(f"{len(files)} files x {args.size} in {tmp}")
+
+        for use_mmap in ([False, True] if args.mmap else [False]):
+            for block_size in block_sizes:
+                for workers in args.workers:
+                    for f in files:
+                        drop_cache(f)
+
+                    start = time.perf_counter()
+                    with ThreadPoolExecutor(max_workers=workers) as pool:
+                        list(pool.map(lambda p: sha1_file(p, block_size, use_mmap), files))
+                    elapsed = time.perf_counter() - start
+
+                    mode = "mmap" if use_mmap else "read"
+                    print(f"  {mode:<4}  block {block_size // 1024:>6} KB  workers {workers:>2}  "
+                          f"{total / elapsed / 1024 / 1024:>9.1f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
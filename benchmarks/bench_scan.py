@@ -0,0 +1,70 @@
+"""
+Scan benchmark: times turning a synthetic put.io listing into sync items.
+
+    python benchmarks/bench_scan.py --items 100000 200000 --depth 6 --mappings 8
+"""
+import argparse
+import random
+import time
+
+from putio_get.client import FileRecord
+from putio_get.config import Config
+from putio_get.scan import ScanPlan
+
+
+def synthetic_tree(count: int, depth: int, fanout: int = 20, seed: int = 1):
+    """Returns a listing of roughly `count` items, with folders nested up to `depth` deep."""
+    rng = random.Random(seed)
+    items = []
+    next_id = 1
+    folders = [(0, 0)]  # (id, depth)
+    exts = ["mkv", "mp4", "srt", "nfo", "jpg", "txt"]
+
+    while len(items) < count:
+        parent_id, parent_depth = rng.choice(folders)
+        if parent_depth < depth and rng.random() < 1 / fanout:
+            items.append(FileRecord(next_id, parent_id, f"Folder {next_id}", 0, None, 'FOLDER'))
+            folders.append((next_id, parent_depth + 1))
+        else:
+            name = f"Show.S01E{next_id % 100:02d}.{rng.choice(exts)}"
+            items.append(FileRecord(next_id, parent_id, name, 1, None, 'VIDEO'))
+        next_id += 1
+
+    # Top level folders used as mapping sources
+    for i, item in enumerate(items):
+        if item.file_type == 'FOLDER' and item.parent_id == 0:
+            item.name = f"Source{i}"
+    return items
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, nargs='+', default=[100_000, 250_000])
+    parser.add_argument('--depth', type=int, default=6)
+    parser.add_argument('--mappings', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    for count in args.items:
+        items = synthetic_tree(count, args.depth)
+        sources = [i.name for i in items if i.file_type == 'FOLDER' and i.parent_id == 0]
+
+        cfg = Config(with_env=False)
+        cfg.paths['map_str'] = ",".join(f"/{s}:/Target{n}" for n, s in enumerate(sources[:args.mappings]))
+        cfg.parse_calculated_values()
+
+        best = None
+        for _ in range(args.repeat):
+            plan = ScanPlan(cfg)
+            folders = {}
+            start = time.perf_counter()
+            results = plan.filter_items(iter(items), folders)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+        print(f"{count:>9} items  {len(folders):>7} folders  {len(results):>8} matched  "
+              f"{best*1000:8.1f} ms  {count/best:>12,.0f} items/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Startup benchmark: import time of the CLI and wall time of trivial commands.
+
+    python benchmarks/bench_startup.py --runs 5 --budget-ms 150
+
+Each command runs in a fresh interpreter with -X importtime. The slowest top level
+imports are listed, and the exit code is 1 when the best run of a trivial command is
+over the budget, so it can guard against modules creeping back into the startup path.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+# Command, and whether it's held to the budget. --help is expected to load rich for its output.
+COMMANDS = {
+    "import": (["-c", "import putio_get.cli"], True),
+    "--version": (["-m", "putio_get", "--version"], True),
+    "--print-config": (["-m", "putio_get", "--print-config", "general"], True),
+    "--help": (["-m", "putio_get", "--help"], False),
+}
+
+
+def run(args):
+    """Returns wall time in seconds and cumulative import times in microseconds by module."""
+    env = {**os.environ, "PYTHONDONTWRITEBYTECODE": "1"}
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", *args], capture_output=True, text=True, env=env)
+    elapsed = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"{' '.join(args)} failed: {proc.stderr[-500:]}")
+
+    imports = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line: continue
+        _, cumulative_us, name = line.split("|")
+        # Top level imports only, nested ones are indented further
+        if not name.startswith("  "):
+            imports[name.strip()] = int(cumulative_us)
+    return elapsed, imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=150, help='Max wall time for each command')
+    parser.add_argument('--top', type=int, default=5, help='Slowest imports to list')
+    args = parser.parse_args()
+
+    over_budget = []
+    for label, (command, budgeted) in COMMANDS.items():
+        best, best_imports = None, {}
+        for _ in range(args.runs):
+            elapsed, imports = run(command)
+            if best is None or elapsed < best:
+                best, best_imports = elapsed, imports
+
+        if not budgeted:
+            status = "not budgeted"
+        else:
+            status = "ok" if best * 1000 <= args.budget_ms else "OVER BUDGET"
+        print(f"{label:<15} {best*1000:8.1f} ms  {status}")
+        for name, us in sorted(best_imports.items(), key=lambda x: x[1], reverse=True)[:args.top]:
+            print(f"    {us/1000:8.1f} ms  {name}")
+        if status == "OVER BUDGET":
+            over_budget.append(label)
+
+    if over_budget:
+        print(f"\nOver the {args.budget_ms:.0f} ms budget: {', '.join(over_budget)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
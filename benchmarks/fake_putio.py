@@ -0,0 +1,368 @@
+"""
+Offline stand-in for put.io: a fake API and a range-capable file server, backed by a
+synthetic account tree. Used by bench_e2e.py, and runnable on its own to point a
+config at it (general.api_url) for manual runs:
+
+    python benchmarks/fake_putio.py --files 5000 --depth 4 --file-size 1MB --port 8080
+
+The API covers what putio-get calls: /files/list, /files/list/continue, /files/{id},
+/files/{id}/url, /files/delete, /trash/empty, /account/info and /events/list.
+File contents are generated from the file ID, so nothing is stored and any byte
+range can be served. Optional API latency and a per-connection rate limit make the
+numbers closer to the real service.
+
+Files added, moved or deleted after the account is generated are recorded in the
+events feed, so the incremental sync mode can be exercised too. FakeAccount.add_file
+does it from a script, --add-every from the command line.
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+CHUNK_SIZE = 64 * 1024
+EXTENSIONS = ["mkv", "mp4", "srt", "nfo", "jpg"]
+EVENTS_PAGE = 50  # /events/list only returns the most recent ones, like put.io
+
+
+class FakeAccount:
+    """A synthetic put.io account: folders nested up to depth, files spread across them."""
+
+    def __init__(self, files: int, depth: int, file_size: int, fanout: int = 10, seed: int = 1):
+        rng = random.Random(seed)
+        self.files: Dict[int, dict] = {}
+        self.children: Dict[int, List[int]] = {0: []}
+        self.trash: List[int] = []
+        self.events: List[dict] = []
+        self._lock = threading.Lock()
+
+        folders = [(0, 0)]  # (id, depth)
+        next_id = 1
+        count = 0
+        while count < files:
+            parent_id, parent_depth = rng.choice(folders)
+            if parent_depth < depth and rng.random() < 1 / fanout:
+                self._add(next_id, parent_id, f"Folder {next_id}", 0, 'FOLDER')
+                folders.append((next_id, parent_depth + 1))
+                self.children[next_id] = []
+            else:
+                ext = rng.choice(EXTENSIONS)
+                self._add(next_id, parent_id, f"Show.S01E{next_id % 100:02d}.{next_id}.{ext}", file_size,
+                          'VIDEO' if ext in ("mkv", "mp4") else 'TEXT')
+                count += 1
+            next_id += 1
+        self._next_id = next_id
+
+        # The transfers that filled the account, so the feed isn't empty before the first change
+        for file_id in self.children[0]:
+            self._event("transfer_completed", file_id)
+
+    def _add(self, file_id: int, parent_id: int, name: str, size: int, file_type: str):
+        self.files[file_id] = {
+            "id": file_id,
+            "parent_id": parent_id,
+            "name": name,
+            "size": size,
+            "file_type": file_type,
+            "sha1": content_sha1(file_id, size) if file_type != 'FOLDER' else None,
+        }
+        self.children[parent_id].append(file_id)
+
+    def _event(self, event_type: str, file_id: int):
+        self.events.append({
+            "id": len(self.events) + 1,
+            "type": event_type,
+            "file_id": file_id,
+            "created_at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S"),
+        })
+
+    def add_file(self, parent_id: int, name: str, size: int, file_type: str = 'VIDEO') -> int:
+        """Adds a file, or a folder with file_type FOLDER, while the server runs. Returns its ID."""
+        with self._lock:
+            file_id = self._next_id
+            self._next_id += 1
+            self._add(file_id, parent_id, name, 0 if file_type == 'FOLDER' else size, file_type)
+            if file_type == 'FOLDER':
+                self.children[file_id] = []
+            self._event("transfer_completed", file_id)
+        return file_id
+
+    def move(self, file_id: int, parent_id: int):
+        with self._lock:
+            file = self.files[file_id]
+            self.children[file["parent_id"]].remove(file_id)
+            self.children[parent_id].append(file_id)
+            file["parent_id"] = parent_id
+            self._event("file_moved", file_id)
+
+    def recent_events(self) -> List[dict]:
+        """The newest events first, as /events/list returns them."""
+        with self._lock:
+            return self.events[::-1][:EVENTS_PAGE]
+
+    def listing(self, parent_id: int) -> List[dict]:
+        """Children of a folder, or every file for -1, like put.io's recursive listing."""
+        with self._lock:
+            if parent_id == -1:
+                return list(self.files.values())
+            return [self.files[i] for i in self.children.get(parent_id, ()) if i in self.files]
+
+    def get(self, file_id: int) -> Optional[dict]:
+        return self.files.get(file_id)
+
+    def delete(self, file_ids: List[int]):
+        with self._lock:
+            for file_id in file_ids:
+                if self.files.pop(file_id, None):
+                    self.trash.append(file_id)
+                    self._event("file_deleted", file_id)
+
+    def empty_trash(self):
+        with self._lock:
+            self.trash.clear()
+
+
+def _pattern(file_id: int) -> bytes:
+    return f"putio-get fake file {file_id}\n".encode()
+
+
+def content(file_id: int, start: int, end: int) -> bytes:
+    """Bytes start..end (exclusive) of a file, repeating a pattern derived from its ID."""
+    pattern = _pattern(file_id)
+    offset = start % len(pattern)
+    repeats = (end - start + offset) // len(pattern) + 1
+    return (pattern * repeats)[offset:offset + end - start]
+
+
+def content_sha1(file_id: int, size: int) -> str:
+    pattern = _pattern(file_id)
+    # Whole multiples of the pattern, so every block starts at offset 0
+    block = pattern * (CHUNK_SIZE // len(pattern) + 1)
+    h = hashlib.sha1()
+    done = 0
+    while done + len(block) <= size:
+        h.update(block)
+        done += len(block)
+    h.update(content(file_id, done, size))
+    return h.hexdigest()
+
+
+class FakePutio:
+    """Runs the fake API and file server on two loopback ports, each from a background thread."""
+
+    def __init__(self, account: FakeAccount, host: str = "127.0.0.1", api_port: int = 0, file_port: int = 0,
+                 api_latency: float = 0.0, rate_limit: int = 0, url_ttl: int = 3600):
+        self.account = account
+        self.api_latency = api_latency
+        self.rate_limit = rate_limit
+        self.url_ttl = url_ttl
+        self.requests: Dict[str, int] = {}
+        self._cursors: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+        self.api = ThreadingHTTPServer((host, api_port), _api_handler(self))
+        self.files = ThreadingHTTPServer((host, file_port), _file_handler(self))
+        for server in (self.api, self.files):
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    @property
+    def api_url(self) -> str:
+        host, port = self.api.server_address[:2]
+        return f"http://{host}:{port}/v2"
+
+    def download_url(self, file_id: int) -> str:
+        host, port = self.files.server_address[:2]
+        return f"http://{host}:{port}/download/{file_id}?expires={int(time.time()) + self.url_ttl}"
+
+    def count(self, endpoint: str):
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def page(self, files: List[dict], offset: int, per_page: int) -> dict:
+        cursor = None
+        if offset + per_page < len(files):
+            cursor = uuid.uuid4().hex
+            with self._lock:
+                self._cursors[cursor] = (files, offset + per_page)
+        return {"files": files[offset:offset + per_page], "cursor": cursor, "status": "OK"}
+
+    def resume(self, cursor: str, per_page: int) -> Optional[dict]:
+        with self._lock:
+            entry = self._cursors.pop(cursor, None)
+        if entry is None: return None
+        files, offset = entry
+        return self.page(files, offset, per_page)
+
+    def close(self):
+        for server in (self.api, self.files):
+            server.shutdown()
+            server.server_close()
+
+
+def _api_handler(fake: FakePutio):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _reply(self, code: int, body: dict):
+            data = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _form(self) -> Dict[str, str]:
+            length = int(self.headers.get("Content-Length") or 0)
+            fields = parse_qs(self.rfile.read(length).decode()) if length else {}
+            return {k: v[0] for k, v in fields.items()}
+
+        def _route(self, method: str):
+            url = urlparse(self.path)
+            path = url.path.removeprefix("/v2")
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+            form = self._form() if method == "POST" else {}
+            parts = path.strip("/").split("/")
+            fake.count(re.sub(r"/\d+", "/{id}", path))
+            if fake.api_latency:
+                time.sleep(fake.api_latency)
+
+            if method == "GET" and path == "/files/list":
+                files = fake.account.listing(int(query.get("parent_id", 0)))
+                return self._reply(200, fake.page(files, 0, int(query.get("per_page", 1000))))
+            if method == "POST" and path == "/files/list/continue":
+                resp = fake.resume(form.get("cursor", ""), int(form.get("per_page", 1000)))
+                return self._reply(200, resp) if resp else self._reply(400, {"error_type": "INVALID_CURSOR"})
+            if method == "GET" and len(parts) == 3 and parts[0] == "files" and parts[2] == "url":
+                if not fake.account.get(int(parts[1])):
+                    return self._reply(404, {"error_type": "NotFound"})
+                return self._reply(200, {"url": fake.download_url(int(parts[1])), "status": "OK"})
+            if method == "GET" and len(parts) == 2 and parts[0] == "files" and parts[1].isdigit():
+                file = fake.account.get(int(parts[1]))
+                return self._reply(200, {"file": file}) if file else self._reply(404, {"error_type": "NotFound"})
+            if method == "POST" and path == "/files/delete":
+                fake.account.delete([int(i) for i in form.get("file_ids", "").split(",") if i])
+                return self._reply(200, {"status": "OK"})
+            if method == "POST" and path == "/trash/empty":
+                fake.account.empty_trash()
+                return self._reply(200, {"status": "OK"})
+            if method == "GET" and path == "/account/info":
+                return self._reply(200, {"info": {"username": "fake"}, "status": "OK"})
+            if method == "GET" and path == "/events/list":
+                return self._reply(200, {"events": fake.account.recent_events(), "status": "OK"})
+            self._reply(404, {"error_type": "NotFound"})
+
+        def do_GET(self):
+            self._route("GET")
+
+        def do_POST(self):
+            self._route("POST")
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def _file_handler(fake: FakePutio):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, head_only: bool):
+            parts = urlparse(self.path).path.strip("/").split("/")
+            file = fake.account.get(int(parts[1])) if len(parts) == 2 and parts[1].isdigit() else None
+            if not file:
+                self.send_error(404)
+                return
+
+            size = file["size"]
+            start, end = 0, size
+            ranged = self.headers.get("Range", "")
+            if ranged.startswith("bytes="):
+                first, _, last = ranged[6:].partition("-")
+                start = int(first) if first else max(0, size - int(last))
+                end = min(size, int(last) + 1) if first and last else size
+                if start >= size:
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{size}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{end - 1}/{size}")
+            else:
+                self.send_response(200)
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(end - start))
+            self.end_headers()
+            if head_only: return
+
+            # Throttled per connection, like put.io limits each one
+            offset, began = start, time.monotonic()
+            while offset < end:
+                chunk_end = min(end, offset + CHUNK_SIZE)
+                self.wfile.write(content(file["id"], offset, chunk_end))
+                offset = chunk_end
+                if fake.rate_limit:
+                    ahead = (offset - start) / fake.rate_limit - (time.monotonic() - began)
+                    if ahead > 0:
+                        time.sleep(ahead)
+
+        def do_GET(self):
+            try:
+                self._send(False)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def do_HEAD(self):
+            self._send(True)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def parse_size(value: str) -> int:
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    value = value.upper().removesuffix("B")
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=1000)
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--file-size', type=str, default="1MB")
+    parser.add_argument('--host', type=str, default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8080, help='API port, the file server uses the next one')
+    parser.add_argument('--api-latency-ms', type=float, default=0)
+    parser.add_argument('--rate-limit', type=str, default="0", help='Per-connection download limit (e.g. 10MB), 0 for none')
+    parser.add_argument('--add-every', type=float, default=0, help='Seconds between new files at the account root, 0 for none')
+    args = parser.parse_args()
+
+    account = FakeAccount(args.files, args.depth, parse_size(args.file_size))
+    fake = FakePutio(account, args.host, args.port, args.port + 1, args.api_latency_ms / 1000, parse_size(args.rate_limit))
+    print(f"Fake put.io API at {fake.api_url} with {args.files} files, Ctrl+C to stop")
+    try:
+        stop = threading.Event()
+        while not stop.wait(args.add_every or None):
+            file_id = account.add_file(0, f"New.Movie.{account._next_id}.mkv", parse_size(args.file_size))
+            print(f"Added file {file_id}")
+    except KeyboardInterrupt:
+        fake.close()
+
+
+if __name__ == "__main__":
+    main()
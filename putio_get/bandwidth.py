@@ -0,0 +1,43 @@
+import logging
+from datetime import datetime
+from typing import Optional
+
+from .config import Config
+from .downloader import Downloader
+
+log = logging.getLogger("rich")
+
+
+def _format_rate(limit: int) -> str:
+    return f"{limit/1024/1024:.2f} MB/s" if limit else "unlimited"
+
+
+class BandwidthManager:
+    """
+    Keeps the engine's overall download limit in line with the rate schedule.
+    The first schedule window containing the current local time applies, windows may
+    wrap past midnight (22:00-06:00), and rate_limit applies outside all of them.
+    Limits change on the running engine, active downloads included.
+    """
+
+    def __init__(self, config: Config, downloader: Downloader):
+        self.downloader = downloader
+        self.default = config.download['rate_limit_bytes']
+        self.rules = config.download['rate_schedule_rules']
+        self.current: Optional[int] = None
+
+    def limit_at(self, when: datetime) -> int:
+        minute = when.hour * 60 + when.minute
+        for start, end, limit in self.rules:
+            inside = start <= minute < end if start < end else minute >= start or minute < end
+            if inside:
+                return limit
+        return self.default
+
+    def update(self):
+        """Applies the limit for the current time if it changed. Cheap enough to call on every poll."""
+        limit = self.limit_at(datetime.now())
+        if limit == self.current: return
+        log.info(f"Download rate limit: {_format_rate(limit)}")
+        self.downloader.set_rate_limit(limit)
+        self.current = limit
@@ -1,31 +1,56 @@
 import argparse
 import signal
 import sys
+from pathlib import Path
 from importlib.metadata import version
-from rich_argparse import RichHelpFormatter
 from .config import Config
-from .core import Application, console
 from .utils import setup_logging
 
 __version__ = version('putio-get')
 
+# Heavier modules (core, rich, the download engines) are imported once a command needs them,
+# so --version, --help and --print-config stay fast. benchmarks/bench_startup.py keeps track.
+
+
+def _help_formatter(prog: str):
+    from rich_argparse import RichHelpFormatter
+    return RichHelpFormatter(prog)
+
+
+class _VersionAction(argparse.Action):
+    """Prints the version without loading the help formatter, unlike argparse's version action."""
+
+    def __init__(self, option_strings, dest=argparse.SUPPRESS, default=argparse.SUPPRESS, help="show program's version number and exit"):
+        super().__init__(option_strings=option_strings, dest=dest, default=default, nargs=0, help=help)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        print(f"{parser.prog} {__version__}")
+        parser.exit()
+
 
 def get_parser():
-    parser = argparse.ArgumentParser(description=f"putio-get sync tool v{__version__}", formatter_class=RichHelpFormatter)
+    parser = argparse.ArgumentParser(description=f"putio-get sync tool v{__version__}", formatter_class=_help_formatter)
 
     # General
-    parser.add_argument('--version', '-v', action='version', version=f'%(prog)s {__version__}')
+    parser.add_argument('--version', '-v', action=_VersionAction)
     parser.add_argument('--log-level', type=str.upper, choices=['TRACE', 'DEBUG', 'INFO', 'WARNING', 'ERROR'], help='Log level')
     parser.add_argument('--daemon', '-d', action='store_true', help='Run in daemon mode (looping)')
     parser.add_argument('--config-file', type=str, default=None, help='Load config from the specified json file. Overridden by env vars then args')
     parser.add_argument('--print-config', type=str, default=None, nargs='?', const='all', help='Print config and exit, optionally specify sections to print (e.g. "general,auth,paths") Any additional arguments/commands are ignored')
 
+    parser.add_argument('--api-max-connections', type=int, help='Max pooled connections to the put.io API')
+    parser.add_argument('--metrics-port', type=int, help='Serve Prometheus metrics on this port in daemon mode')
+    parser.add_argument('--profile', type=str, help='Profile the run, writing cProfile stats to this file and a report by phase to the same name with .txt')
+    parser.add_argument('--profile-iterations', type=int, help='With --profile in daemon mode, stop after this many iterations (0 runs until stopped)')
+
     # Auth
     parser.add_argument('--oauth-token', type=str, help='Put.io OAuth Token')
 
     # Paths
     parser.add_argument('--target', type=str, help='Target directory')
     parser.add_argument('--map', type=str, help='Sync map (source:target pairs)')
+    parser.add_argument('--state-file', type=str, help='Sync state database, empty to disable')
+    parser.add_argument('--staging-dir', type=str, help='Download to a fast local directory first')
 
     # Permissions
     parser.add_argument('--target-uid', type=int, help='Target UID')
@@ -39,18 +64,28 @@ def get_parser():
     parser.add_argument('--skip-existing', action='store_true', help='Skip files present at startup')
     parser.add_argument('--empty-trash', action='store_true', help='Empty trash after move')
     parser.add_argument('--poll-interval', type=int, help='Seconds between polls')
+    parser.add_argument('--sync-mode', type=str, choices=['full', 'incremental'], help='How the daemon detects new files')
+    parser.add_argument('--full-scan-interval', type=int, help='Seconds between full scans in incremental mode')
 
     # Download
     parser.add_argument('--filetypes', type=str, help='Allowed extensions')
     parser.add_argument('--max-segments', type=int, help='Max connections per download')
     parser.add_argument('--min-segment-size', type=str, help='Min segment size')
     parser.add_argument('--max-concurrent-downloads', type=int, help='Max global concurrent downloads')
+    parser.add_argument('--schedule', type=str, help='Download order policies, e.g. "smallest,subtitles,fair"')
+    parser.add_argument('--rate-limit', type=str, help='Overall download speed limit (e.g. 20MB/s), 0 for none')
+    parser.add_argument('--rate-schedule', type=str, help='Speed limits by time of day, e.g. "08:00-18:00=5MB,18:00-23:00=20MB"')
+    parser.add_argument('--small-file-size', type=str, help='Files up to this size (e.g. 50MB) can use extra slots while larger downloads run')
+    parser.add_argument('--auto-tune', action='store_true', help='Tune segments and concurrency from throughput')
+    parser.add_argument('--engine', type=str, choices=['auto', 'aria2', 'native'], help='Download engine')
+    parser.add_argument('--verify-workers', type=int, help='Max existing files hashed at once')
 
     # Mirrors
     parser.add_argument('--enable-mirrors', action='store_true', help='Enable mirrors')
     parser.add_argument('--min-mirror-speed', type=str, help='Min mirror speed')
     parser.add_argument('--benchmark-file', type=str, help='Benchmark json file')
     parser.add_argument('--benchmark-only', action='store_true', help='Run benchmark and exit')
+    parser.add_argument('--benchmark-concurrency', type=int, help='Mirrors benchmarked at once')
 
     return parser
 
@@ -70,6 +105,10 @@ def main():
     # General
     if args.log_level: cfg.general['log_level'] = args.log_level
     if args.daemon: cfg.general['daemon'] = args.daemon
+    if args.api_max_connections: cfg.general['api_max_connections'] = args.api_max_connections
+    if args.metrics_port: cfg.general['metrics_port'] = args.metrics_port
+    if args.profile: cfg.general['profile'] = Path(args.profile)
+    if args.profile_iterations is not None: cfg.general['profile_iterations'] = args.profile_iterations
 
     # Auth
     if args.oauth_token: cfg.auth['oauth_token'] = args.oauth_token
@@ -77,6 +116,8 @@ def main():
     # Paths
     if args.target: cfg.paths['target'] = Path(args.target)
     if args.map: cfg.paths['map_str'] = args.map
+    if args.staging_dir: cfg.paths['staging'] = Path(args.staging_dir)
+    if args.state_file is not None: cfg.paths['state_file'] = Path(args.state_file) if args.state_file else None
 
     # Permissions
     if args.target_uid: cfg.permissions['target_uid'] = args.target_uid
@@ -90,18 +131,28 @@ def main():
     if args.skip_existing: cfg.behavior['skip_existing'] = True
     if args.empty_trash: cfg.behavior['empty_trash'] = True
     if args.poll_interval: cfg.behavior['poll_interval'] = args.poll_interval
+    if args.sync_mode: cfg.behavior['sync_mode'] = args.sync_mode
+    if args.full_scan_interval: cfg.behavior['full_scan_interval'] = args.full_scan_interval
 
     # Download
     if args.filetypes: cfg.download['filetypes_str'] = args.filetypes
     if args.max_segments: cfg.download['max_segments'] = args.max_segments
     if args.min_segment_size: cfg.download['min_segment_size'] = args.min_segment_size
     if args.max_concurrent_downloads: cfg.download['max_concurrent'] = args.max_concurrent_downloads
+    if args.schedule: cfg.download['schedule'] = args.schedule
+    if args.small_file_size: cfg.download['small_file_size'] = args.small_file_size
+    if args.rate_limit: cfg.download['rate_limit'] = args.rate_limit
+    if args.rate_schedule: cfg.download['rate_schedule'] = args.rate_schedule
+    if args.auto_tune: cfg.download['auto_tune'] = True
+    if args.engine: cfg.download['engine'] = args.engine
+    if args.verify_workers: cfg.download['verify_workers'] = args.verify_workers
 
     # Mirrors
     if args.enable_mirrors: cfg.mirrors['enabled'] = True
     if args.min_mirror_speed: cfg.mirrors['min_speed'] = args.min_mirror_speed
     if args.benchmark_file: cfg.mirrors['benchmark_file'] = args.benchmark_file
     if args.benchmark_only: cfg.mirrors['benchmark_only'] = True
+    if args.benchmark_concurrency: cfg.mirrors['benchmark_concurrency'] = args.benchmark_concurrency
 
     # Parse calculated values since they may have changed from args
     cfg.parse_calculated_values()
@@ -116,6 +167,7 @@ def main():
         print("Error: PUTIO_OAUTH_TOKEN is required.")
         sys.exit(1)
 
+    from .core import Application, console
     app = Application(cfg)
 
     def signal_handler(signum, frame):
@@ -126,7 +178,14 @@ def main():
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
 
-    app.start()
+    try:
+        if cfg.general['profile']:
+            from .profiling import run_profiled
+            run_profiled(app.start, cfg.general['profile'])
+        else:
+            app.start()
+    finally:
+        app.close()
 
 
 if __name__ == "__main__":
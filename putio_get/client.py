@@ -1,11 +1,53 @@
+import re
+import sys
+import time
 import logging
+import threading
 import httpx
-from typing import Optional, List, Dict, Any
+from pathlib import Path
+from urllib.parse import urlparse, parse_qsl
+from typing import Optional, List, Dict, Any, Iterator
+from . import metrics
 from .config import Config
 
 log = logging.getLogger("rich")
 
 
+def url_expiry(url: str, default_ttl: int) -> float:
+    """Returns when a download URL expires, from its expires parameter if it has one."""
+    for key, value in parse_qsl(urlparse(url).query):
+        if key.lower() in ("expires", "expire", "exp") and value.isdigit():
+            return float(value)
+    return time.time() + default_ttl
+
+
+class FileRecord:
+    """The fields of a put.io file that the sync needs, without the rest of the API object."""
+    __slots__ = ("id", "parent_id", "name", "size", "sha1", "file_type", "rel_path", "target_root")
+
+    def __init__(self, id: int, parent_id: int, name: str, size: int, sha1: Optional[str], file_type: str):
+        self.id = id
+        self.parent_id = parent_id
+        self.name = name
+        self.size = size
+        self.sha1 = sha1
+        self.file_type = file_type
+        # Set by the scan for files that will be synced
+        self.rel_path: Optional[Path] = None
+        self.target_root: Optional[Path] = None
+
+    @classmethod
+    def from_api(cls, data: Dict) -> "FileRecord":
+        return cls(
+            data['id'],
+            data.get('parent_id') or 0,
+            data['name'],
+            data.get('size') or 0,
+            data.get('sha1') or None,
+            sys.intern(data['file_type'])
+        )
+
+
 class PutioClient:
     def __init__(self, config: Config):
         self.config = config
@@ -15,29 +57,83 @@ class PutioClient:
         }
         self.base_url = self.config.general['api_url'].rstrip("/")
 
-    def _request(self, method: str, endpoint: str, params: Optional[Dict] = None, data: Optional[Dict] = None) -> Any:
+        http2 = self.config.general['api_http2']
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                log.debug("h2 is not installed, using HTTP/1.1 for API requests.")
+                http2 = False
+
+        # One pooled session for the lifetime of the client, so API calls reuse connections
+        self.session = httpx.Client(
+            timeout=30.0,
+            http2=http2,
+            headers=self.headers,
+            limits=httpx.Limits(
+                max_connections=self.config.general['api_max_connections'],
+                max_keepalive_connections=self.config.general['api_max_keepalive'],
+                keepalive_expiry=60.0
+            )
+        )
+        self._stats = {"requests": 0, "connections": 0}
+        self._stats_lock = threading.Lock()
+
+    def _trace(self, event_name: str, info: Dict):
+        if event_name == "connection.connect_tcp.complete":
+            with self._stats_lock:
+                self._stats["connections"] += 1
+
+    def stats(self) -> Dict[str, int]:
+        """Returns request and connection counts. Requests that didn't open a connection reused one."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["reused"] = max(0, stats["requests"] - stats["connections"])
+        return stats
+
+    def close(self):
+        stats = self.stats()
+        log.debug(f"API session closed. Requests: {stats['requests']}, Connections: {stats['connections']}, Reused: {stats['reused']}")
+        self.session.close()
+
+    def _request(self, method: str, endpoint: str, params: Optional[Dict] = None, data: Optional[Dict] = None,
+                 missing_ok: bool = False) -> Any:
+        """Returns the JSON response. With missing_ok, a 404 is only logged at debug level, it still raises."""
         url = f"{self.base_url}{endpoint}"
+        with self._stats_lock:
+            self._stats["requests"] += 1
+        # File IDs are left out, so each endpoint is one series
+        label = re.sub(r"/\d+", "/{id}", endpoint)
         try:
-            with httpx.Client(timeout=30.0) as client:
-                resp = client.request(method, url, headers=self.headers, params=params, data=data)
-                resp.raise_for_status()
-                json_resp = resp.json()
-                return json_resp
+            with metrics.timer("putio_api_request_seconds", endpoint=label):
+                resp = self.session.request(method, url, params=params, data=data, extensions={"trace": self._trace})
+            resp.raise_for_status()
+            json_resp = resp.json()
+            return json_resp
         except httpx.HTTPStatusError as e:
+            if missing_ok and e.response.status_code == 404:
+                log.debug(f"Not found: {method} {endpoint}")
+                raise
+            metrics.inc("putio_api_errors_total", endpoint=label)
             log.error(f"API Error {e.response.status_code} for {method} {endpoint}: {e.response.text}")
             raise
         except Exception as e:
+            metrics.inc("putio_api_errors_total", endpoint=label)
             log.error(f"Request failed for {method} {endpoint}: {e}")
             raise
 
-    def list_files(self) -> List[Dict]:
+    def account_info(self) -> Dict:
+        """Returns the account details. Raises on failure, so it doubles as a connection check."""
+        return self._request("GET", "/account/info").get("info", {})
+
+    def list_files(self, parent_id: int = -1) -> Iterator[FileRecord]:
         """
-        List all files recursively using parent_id=-1.
+        Yields the children of a folder one page at a time. The default parent_id=-1 lists all files recursively.
+        Raises if a page can't be fetched, so a cut short listing isn't mistaken for a complete one.
         """
-        files = []
         try:
             params = {
-                "parent_id": -1,
+                "parent_id": parent_id,
                 "per_page": 1000,
                 "stream_url": False,
                 "mp4_status": False,
@@ -54,8 +150,9 @@ class PutioClient:
                     endpoint = "/files/list"
                     resp = self._request("GET", endpoint, params=params)
 
-                if "files" in resp:
-                    files.extend(resp["files"])
+                # Only the trimmed records outlive the page
+                for file in resp.get("files", ()):
+                    yield FileRecord.from_api(file)
 
                 cursor = resp.get("cursor")
                 if not cursor:
@@ -63,8 +160,40 @@ class PutioClient:
 
         except Exception as e:
             log.error(f"Failed to list files: {e}")
+            raise
 
-        return files
+    def list_subtree(self, file_id: int) -> Iterator[FileRecord]:
+        """
+        Yields a file, or a folder and everything below it.
+        """
+        root = self.get_file(file_id)
+        if not root: return
+
+        yield root
+        pending = [root.id] if root.file_type == 'FOLDER' else []
+        while pending:
+            for child in self.list_files(parent_id=pending.pop()):
+                if child.file_type == 'FOLDER':
+                    pending.append(child.id)
+                yield child
+
+    def get_file(self, file_id: int) -> Optional[FileRecord]:
+        try:
+            # Files from older events may be gone since
+            resp = self._request("GET", f"/files/{file_id}", missing_ok=True)
+            return FileRecord.from_api(resp["file"])
+        except Exception:
+            return None
+
+    def list_events(self) -> Optional[List[Dict]]:
+        """
+        Returns the most recent account events, newest first, or None if the feed is unavailable.
+        """
+        try:
+            resp = self._request("GET", "/events/list")
+            return resp.get("events", [])
+        except Exception:
+            return None
 
     def get_file_url(self, file_id: int) -> Optional[str]:
         try:
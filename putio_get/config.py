@@ -1,15 +1,25 @@
 import os
+import logging
 from pathlib import Path
 from typing import Set
 import json
 from .utils import serialize_object, deep_merge
 
+log = logging.getLogger("rich")
+
 class Config:
     def __init__(self, with_env=True, import_config=None):
         self.general = {
             "api_url": "https://api.put.io/v2",
             "log_level": "INFO",
             "daemon": False,
+            "api_http2": True,
+            "api_max_connections": 10,
+            "api_max_keepalive": 10,
+            "metrics_host": "127.0.0.1",
+            "metrics_port": 0,
+            "profile": None,
+            "profile_iterations": 1,
         }
         self.auth = {
             "oauth_token": "",
@@ -18,6 +28,9 @@ class Config:
             "target": Path("/target"),
             "map_str": "",
             "sync_mappings": {},
+            "state_file": Path("putio_state.db"),
+            "session_file": Path("aria2.session"),
+            "staging": None,
         }
         self.permissions = {
             "target_uid": 1000,
@@ -31,6 +44,12 @@ class Config:
             "skip_existing": False,
             "empty_trash": False,
             "poll_interval": 300,
+            "guessit_cache_size": 50000,
+            "guessit_workers": 0,  # 0 uses every CPU
+            "inventory": True,
+            "watch_target": False,
+            "sync_mode": "full",  # full or incremental
+            "full_scan_interval": 3600,
         }
         self.download = {
             "filetypes_str": "",
@@ -39,6 +58,30 @@ class Config:
             "min_segment_size": "50MB",
             "min_segment_size_bytes": 0,
             "max_concurrent": 3,
+            "auto_tune": False,
+            "max_segments_limit": 16,
+            "max_concurrent_limit": 8,
+            "tune_interval": 30,
+            "engine": "auto",  # auto, aria2 or native
+            "verify_workers": 2,
+            "verify_block_size": "8MB",
+            "verify_block_size_bytes": 0,
+            "verify_mmap": False,
+            "mover_workers": 2,
+            "staging_min_free": "1GB",
+            "staging_min_free_bytes": 0,
+            "url_workers": 4,
+            "url_prefetch": 6,
+            "url_ttl": 3600,
+            "schedule": "path",
+            "schedule_weights": "",
+            "small_file_size": "0",
+            "small_file_size_bytes": 0,
+            "small_file_slots": 2,
+            "rate_limit": "0",
+            "rate_limit_bytes": 0,
+            "rate_schedule": "",  # e.g. 08:00-18:00=5MB,18:00-23:00=20MB
+            "rate_schedule_rules": [],
         }
         self.mirrors = {
             "enabled": False,
@@ -46,6 +89,9 @@ class Config:
             "min_speed_bytes": 0,
             "benchmark_only": False,
             "benchmark_file": Path("mirror_speeds.json"),
+            "benchmark_concurrency": 3,
+            "benchmark_stagger": 0.5,
+            "benchmark_ttl": 86400,
             "map": {
                 "Montreal": "bhs1",
                 "New_York": "ny1",
@@ -80,9 +126,21 @@ class Config:
                     setattr(self, key, merged)
 
             # Convert json objects back to appropriate types
+            if isinstance(self.general.get('profile'), str):
+                self.general['profile'] = Path(self.general['profile']) if self.general['profile'] else None
+
             if isinstance(self.paths.get('target'), str):
                 self.paths['target'] = Path(self.paths['target'])
 
+            if isinstance(self.paths.get('state_file'), str):
+                self.paths['state_file'] = Path(self.paths['state_file']) if self.paths['state_file'] else None
+
+            if isinstance(self.paths.get('staging'), str):
+                self.paths['staging'] = Path(self.paths['staging']) if self.paths['staging'] else None
+
+            if isinstance(self.paths.get('session_file'), str):
+                self.paths['session_file'] = Path(self.paths['session_file']) if self.paths['session_file'] else None
+
             if isinstance(self.paths.get('sync_mappings'), dict):
                 for key, value in self.paths['sync_mappings'].items():
                     if isinstance(value, str):
@@ -107,6 +165,14 @@ class Config:
         """Load config from environment variables."""
         # General
         self.general['log_level'] = os.environ.get('LOG_LEVEL', self.general['log_level']).upper()
+        self.general['api_http2'] = os.environ.get('PUTIO_API_HTTP2', str(self.general['api_http2'])).lower() == 'true'
+        self.general['api_max_connections'] = int(os.environ.get('PUTIO_API_MAX_CONNECTIONS', self.general['api_max_connections']))
+        self.general['api_max_keepalive'] = int(os.environ.get('PUTIO_API_MAX_KEEPALIVE', self.general['api_max_keepalive']))
+        self.general['metrics_host'] = os.environ.get('PUTIO_METRICS_HOST', self.general['metrics_host'])
+        self.general['metrics_port'] = int(os.environ.get('PUTIO_METRICS_PORT', self.general['metrics_port']))
+        profile = os.environ.get('PUTIO_PROFILE', str(self.general['profile'] or ''))
+        self.general['profile'] = Path(profile) if profile else None
+        self.general['profile_iterations'] = int(os.environ.get('PUTIO_PROFILE_ITERATIONS', self.general['profile_iterations']))
 
         # Auth
         self.auth['oauth_token'] = os.environ.get('PUTIO_OAUTH_TOKEN', self.auth['oauth_token'])
@@ -121,6 +187,12 @@ class Config:
         # Paths
         self.paths['target'] = Path(os.environ.get('PUTIO_TARGET', str(self.paths['target'])))
         self.paths['map_str'] = os.environ.get('PUTIO_DIRECTORY_MAP', self.paths['map_str'])
+        state_file = os.environ.get('PUTIO_STATE_FILE', str(self.paths['state_file'] or ''))
+        self.paths['state_file'] = Path(state_file) if state_file else None
+        staging = os.environ.get('PUTIO_STAGING_DIR', str(self.paths['staging'] or ''))
+        self.paths['staging'] = Path(staging) if staging else None
+        session_file = os.environ.get('PUTIO_SESSION_FILE', str(self.paths['session_file'] or ''))
+        self.paths['session_file'] = Path(session_file) if session_file else None
 
         # Permissions
         self.permissions['target_uid'] = int(os.environ.get('PUTIO_TARGET_UID', self.permissions['target_uid']))
@@ -134,18 +206,46 @@ class Config:
         self.behavior['skip_existing'] = os.environ.get('PUTIO_SKIP_EXISTING', str(self.behavior['skip_existing'])).lower() == 'true'
         self.behavior['empty_trash'] = os.environ.get('PUTIO_EMPTY_TRASH', str(self.behavior['empty_trash'])).lower() == 'true'
         self.behavior['poll_interval'] = int(os.environ.get('PUTIO_POLL_INTERVAL_SECONDS', self.behavior['poll_interval']))
+        self.behavior['guessit_cache_size'] = int(os.environ.get('PUTIO_GUESSIT_CACHE_SIZE', self.behavior['guessit_cache_size']))
+        self.behavior['guessit_workers'] = int(os.environ.get('PUTIO_GUESSIT_WORKERS', self.behavior['guessit_workers']))
+        self.behavior['inventory'] = os.environ.get('PUTIO_LOCAL_INVENTORY', str(self.behavior['inventory'])).lower() == 'true'
+        self.behavior['watch_target'] = os.environ.get('PUTIO_WATCH_TARGET', str(self.behavior['watch_target'])).lower() == 'true'
+        self.behavior['sync_mode'] = os.environ.get('PUTIO_SYNC_MODE', self.behavior['sync_mode']).lower()
+        self.behavior['full_scan_interval'] = int(os.environ.get('PUTIO_FULL_SCAN_INTERVAL_SECONDS', self.behavior['full_scan_interval']))
 
         # Download
         self.download['filetypes_str'] = os.environ.get('PUTIO_FILETYPES', self.download['filetypes_str'])
         self.download['max_segments'] = int(os.environ.get('PUTIO_MAX_SEGMENTS', self.download['max_segments']))
         self.download['min_segment_size'] = os.environ.get('PUTIO_MIN_SEGMENT_SIZE', self.download['min_segment_size'])
         self.download['max_concurrent'] = int(os.environ.get('PUTIO_MAX_CONCURRENT_DOWNLOADS', self.download['max_concurrent']))
+        self.download['auto_tune'] = os.environ.get('PUTIO_AUTO_TUNE', str(self.download['auto_tune'])).lower() == 'true'
+        self.download['max_segments_limit'] = int(os.environ.get('PUTIO_MAX_SEGMENTS_LIMIT', self.download['max_segments_limit']))
+        self.download['max_concurrent_limit'] = int(os.environ.get('PUTIO_MAX_CONCURRENT_LIMIT', self.download['max_concurrent_limit']))
+        self.download['tune_interval'] = int(os.environ.get('PUTIO_TUNE_INTERVAL_SECONDS', self.download['tune_interval']))
+        self.download['engine'] = os.environ.get('PUTIO_DOWNLOAD_ENGINE', self.download['engine']).lower()
+        self.download['verify_workers'] = int(os.environ.get('PUTIO_VERIFY_WORKERS', self.download['verify_workers']))
+        self.download['verify_block_size'] = os.environ.get('PUTIO_VERIFY_BLOCK_SIZE', self.download['verify_block_size'])
+        self.download['verify_mmap'] = os.environ.get('PUTIO_VERIFY_MMAP', str(self.download['verify_mmap'])).lower() == 'true'
+        self.download['mover_workers'] = int(os.environ.get('PUTIO_MOVER_WORKERS', self.download['mover_workers']))
+        self.download['staging_min_free'] = os.environ.get('PUTIO_STAGING_MIN_FREE', self.download['staging_min_free'])
+        self.download['url_workers'] = int(os.environ.get('PUTIO_URL_WORKERS', self.download['url_workers']))
+        self.download['url_prefetch'] = int(os.environ.get('PUTIO_URL_PREFETCH', self.download['url_prefetch']))
+        self.download['url_ttl'] = int(os.environ.get('PUTIO_URL_TTL_SECONDS', self.download['url_ttl']))
+        self.download['schedule'] = os.environ.get('PUTIO_SCHEDULE', self.download['schedule'])
+        self.download['schedule_weights'] = os.environ.get('PUTIO_SCHEDULE_WEIGHTS', self.download['schedule_weights'])
+        self.download['small_file_size'] = os.environ.get('PUTIO_SMALL_FILE_SIZE', self.download['small_file_size'])
+        self.download['small_file_slots'] = int(os.environ.get('PUTIO_SMALL_FILE_SLOTS', self.download['small_file_slots']))
+        self.download['rate_limit'] = os.environ.get('PUTIO_RATE_LIMIT', self.download['rate_limit'])
+        self.download['rate_schedule'] = os.environ.get('PUTIO_RATE_SCHEDULE', self.download['rate_schedule'])
 
         # Mirrors
         self.mirrors['enabled'] = os.environ.get('PUTIO_ENABLE_MIRRORS', str(self.mirrors['enabled'])).lower() == 'true'
         self.mirrors['min_speed'] = os.environ.get('PUTIO_MIN_MIRROR_SPEED', self.mirrors['min_speed'])
         self.mirrors['benchmark_only'] = os.environ.get('PUTIO_BENCHMARK_ONLY', str(self.mirrors['benchmark_only'])).lower() == 'true'
         self.mirrors['benchmark_file'] = Path(os.environ.get('PUTIO_BENCHMARK_FILE', str(self.mirrors['benchmark_file'])))
+        self.mirrors['benchmark_concurrency'] = int(os.environ.get('PUTIO_BENCHMARK_CONCURRENCY', self.mirrors['benchmark_concurrency']))
+        self.mirrors['benchmark_stagger'] = float(os.environ.get('PUTIO_BENCHMARK_STAGGER', self.mirrors['benchmark_stagger']))
+        self.mirrors['benchmark_ttl'] = int(os.environ.get('PUTIO_BENCHMARK_TTL_SECONDS', self.mirrors['benchmark_ttl']))
 
 
     def parse_calculated_values(self):
@@ -165,10 +265,23 @@ class Config:
         if self.download['min_segment_size'] and not self.download['min_segment_size_bytes']:
             self.download['min_segment_size_bytes'] = self._parse_size(self.download['min_segment_size'])
 
+        if self.download['verify_block_size'] and not self.download['verify_block_size_bytes']:
+            self.download['verify_block_size_bytes'] = self._parse_size(self.download['verify_block_size'])
+
+        if self.download['staging_min_free'] and not self.download['staging_min_free_bytes']:
+            self.download['staging_min_free_bytes'] = self._parse_size(self.download['staging_min_free'])
+
+        if self.download['small_file_size'] and not self.download['small_file_size_bytes']:
+            self.download['small_file_size_bytes'] = self._parse_size(self.download['small_file_size'])
+
+        if self.download['rate_limit'] and not self.download['rate_limit_bytes']:
+            self.download['rate_limit_bytes'] = self._parse_rate(self.download['rate_limit'])
+
+        if self.download['rate_schedule'] and not self.download['rate_schedule_rules']:
+            self._parse_rate_schedule()
+
         if self.mirrors['min_speed'] and not self.mirrors['min_speed_bytes']:
-            val = self.mirrors['min_speed'].strip()
-            if val.lower().endswith('/s'): val = val[:-2]
-            self.mirrors['min_speed_bytes'] = self._parse_size(val)
+            self.mirrors['min_speed_bytes'] = self._parse_rate(self.mirrors['min_speed'])
 
         # Parse Map
         if self.paths['map_str'] and not self.paths['sync_mappings']:
@@ -190,6 +303,26 @@ class Config:
             return 0
 
 
+    def _parse_rate(self, rate_str: str) -> int:
+        """Parse a speed string (e.g. 5MB/s or 5MB) into bytes per second."""
+        val = rate_str.strip()
+        if val.lower().endswith('/s'): val = val[:-2]
+        return self._parse_size(val)
+
+
+    def _parse_rate_schedule(self):
+        """Parse the rate schedule into [start minute, end minute, bytes per second] rules."""
+        for entry in self.download['rate_schedule'].split(','):
+            if not entry.strip(): continue
+            try:
+                window, rate = entry.split('=', 1)
+                start, end = (int(h) * 60 + int(m) for h, m in (t.strip().split(':') for t in window.split('-', 1)))
+            except ValueError:
+                log.warning(f"Ignoring invalid rate schedule entry '{entry.strip()}', expected e.g. 08:00-18:00=5MB")
+                continue
+            self.download['rate_schedule_rules'].append([start, end, self._parse_rate(rate)])
+
+
     def _parse_sync_map(self):
         """Parse the sync map string into a dictionary."""
         if not self.paths['map_str']: return
@@ -1,19 +1,32 @@
+import asyncio
 import logging
 import threading
+import time
 from pathlib import Path
 from typing import Set, Dict, List, Optional
 
-from guessit import guessit
 from rich.console import Console
 
+from . import metrics
+from .bandwidth import BandwidthManager
 from .config import Config
-from .downloader import Downloader
-from .client import PutioClient
-from .utils import apply_permissions, verify_sha1, sanitize_filename
+from .downloader import create_downloader
+from .client import PutioClient, FileRecord
+from .pipeline import DownloadPipeline
+from .scan import ScanPlan
+from .scheduling import Scheduler
+from .inventory import LocalInventory
+from .naming import Renamer
+from .state import StateStore
+from .tuning import ThroughputTuner
+from .utils import DirectoryCache, fs_calls, sanitize_filename
 
 log = logging.getLogger("rich")
 console = Console()
 
+# Events for files that are gone, there is nothing to list for them
+REMOVAL_EVENTS = frozenset({'file_deleted', 'file_trashed', 'file_from_rss_deleted_for_space'})
+
 
 class Application:
     def __init__(self, config: Config):
@@ -21,42 +34,90 @@ class Application:
         self.exit_event = threading.Event()
         self.downloader = None
         self.client = None
-        self.known_files = {}  # id -> file_obj
+        self.state = None
+        self.scoreboard = None
+        self.tuner = None
+        self.bandwidth: Optional[BandwidthManager] = None
+        self.dirs: Optional[DirectoryCache] = None
+        self.inventory: Optional[LocalInventory] = None
+        self.renamer: Optional[Renamer] = None
+        self.metrics_server = None
+        self.known_files: Dict[str, FileRecord] = {}
+        self.folders: Dict[int, FileRecord] = {}  # from the last full scan plus incremental additions
+        self.last_event_id = None
+        self.last_full_scan = 0.0
+        self.scan_plan = ScanPlan(config)
+        self.scheduler = Scheduler(config)
 
     def start(self):
         # Benchmark
         if self.config.mirrors['enabled'] or self.config.mirrors['benchmark_only']:
-            from .mirrors import get_mirror_rankings
-            self.sorted_mirrors = get_mirror_rankings(self.config)
+            from .mirrors import MirrorScoreboard, load_benchmarks
+            self.scoreboard = MirrorScoreboard(self.config, *load_benchmarks(self.config))
             if self.config.mirrors['benchmark_only']:
                 console.print("\n[bold green]Benchmark Complete.[/bold green]")
-                for m in self.sorted_mirrors:
-                    console.print(f"  {m['name']}: {m['speed']/1024/1024:.2f} MB/s")
+                for m in self.scoreboard.ranked():
+                    ttfb = f" (TTFB: {m['ttfb']*1000:.0f} ms)" if m.get('ttfb') is not None else ""
+                    console.print(f"  {m['name']}: {m['speed']/1024/1024:.2f} MB/s{ttfb}")
                 return
-        else:
-            self.sorted_mirrors = None
+
+        if self.config.general['daemon'] and self.config.general['metrics_port']:
+            self.metrics_server = metrics.serve(self.config.general['metrics_host'], self.config.general['metrics_port'])
 
         # Init Client
         self.client = PutioClient(self.config)
         try:
-            self.client.list_files()
+            self.client.account_info()
             log.info("Connected to Put.io API successfully.")
         except Exception as e:
             log.critical(f"Failed to connect to Put.io API: {e}")
             return
 
         # Init Downloader
-        self.downloader = Downloader(self.config, self.sorted_mirrors)
-
-        self._ensure_dir(self.config.paths['target'])
+        self.downloader = create_downloader(self.config, self.scoreboard)
+        if self.config.download['auto_tune']:
+            self.tuner = ThroughputTuner(self.config, self.downloader)
+        if self.config.download['rate_limit_bytes'] or self.config.download['rate_schedule_rules']:
+            self.bandwidth = BandwidthManager(self.config, self.downloader)
+            self.bandwidth.update()
+
+        if self.config.paths['state_file']:
+            self.state = StateStore(self.config.paths['state_file'])
+        self.renamer = Renamer(self.config, self.state)
+
+        self.dirs = DirectoryCache(self.config.paths['target'],
+            self.config.permissions['target_uid'],
+            self.config.permissions['target_gid'],
+            self.config.permissions['target_fmode'],
+            self.config.permissions['target_dmode'])
+        self.downloader.dirs = self.dirs
         console.print(f"Target Directory: {self.config.paths['target']}")
 
+        if self.config.behavior['inventory']:
+            self.inventory = LocalInventory(self._target_roots())
+            self.inventory.build()
+            if self.config.general['daemon'] and self.config.behavior['watch_target']:
+                self.inventory.watch()
+
         # Initial Scan
-        self.known_files = self._scan_files()
-        log.info(f"Initial scan complete. Found {len(self.known_files)} items.")
+        files = self._scan_files()
+        if files is None:
+            log.error("Initial scan failed, unfinished downloads are kept until a scan completes.")
+        else:
+            self.known_files = files
+            log.info(f"Initial scan complete. Found {len(self.known_files)} items.")
+            self._collect_orphans(self.known_files)
 
         if not self.config.behavior['skip_existing']:
             self._process_files(self.known_files, "Processing Existing Items")
+        elif self.state:
+            # Downloads cut short by a restart are finished even when skipping existing items
+            unfinished = {k: v for k, v in self.known_files.items() if v.id in self.state.transfers()}
+            self._process_files(unfinished, "Resuming Unfinished Downloads")
+
+        if self.inventory and not self.inventory.watching:
+            # Without a watcher it would go stale, daemon polls check the disk instead
+            self.inventory = None
 
         if self.config.general['daemon']:
             self._run_daemon()
@@ -67,170 +128,149 @@ class Application:
         log.info("Shutting down application...")
         self.exit_event.set()
 
-    def _ensure_dir(self, path: Path):
-        base = self.config.paths['target']
-        path = path if path.is_absolute() else base / path
-
-        if not path.is_relative_to(base):
-            raise ValueError("Path escapes target")
-
-        current = base
-        for part in path.relative_to(base).parts:
-            current /= part
-            if not current.exists():
-                log.info(f"Creating Directory: {str(current)}")
-                current.mkdir()
-                apply_permissions(current, False,
-                    self.config.permissions['target_uid'],
-                    self.config.permissions['target_gid'],
-                    self.config.permissions['target_fmode'],
-                    self.config.permissions['target_dmode'])
-
-    def _scan_files(self) -> Dict[str, Dict]:
+    def close(self):
+        """Releases the downloader, API session and state store. Called once start() has returned."""
+        if self.downloader:
+            self.downloader.close()
+        if self.client:
+            self.client.close()
+        if self.state:
+            self.state.close()
+        if self.inventory:
+            self.inventory.close()
+        if self.metrics_server:
+            self.metrics_server.shutdown()
+
+    def _target_roots(self) -> Set[Path]:
+        """Local directories files are synced into."""
+        target = self.config.paths['target']
+        if not self.config.paths['sync_mappings']:
+            return {target}
+        return {target / tgt for tgt in self.config.paths['sync_mappings'].values()}
+
+    def _scan_files(self) -> Optional[Dict[str, FileRecord]]:
         """
-        Returns a dictionary of file_id -> file_object
+        Returns a dictionary of file_id -> file record
         Also resolves full paths for files.
+        Returns None if the listing failed part way, as it can't tell which files are gone.
         """
-        all_items = self.client.list_files()
-
-        id_map = {item['id']: item for item in all_items}
-
-        def get_path(item_id):
-            item = id_map.get(item_id)
-            if not item: return Path("/")
-            if item.get('parent_id') and item['parent_id'] > 0:
-                return get_path(item['parent_id']) / item['name']
-            return Path("/") / item['name']
-
-        results = {}
-        for item in all_items:
-            if item['file_type'] == 'FOLDER': continue
-
-            full_path = get_path(item['id'])
-
-            ext = "." + item['name'].split('.')[-1].lower() if '.' in item['name'] else ""
-            if ext not in self.config.download['allowed_extensions']:
-                continue
-
-            target_root = self.config.paths['target']
-            rel_path = None
-
-            if self.config.paths['sync_mappings']:
-                matched_map = False
-                for src_map, tgt_map in self.config.paths['sync_mappings'].items():
-                    src_path_obj = Path("/") / src_map
-                    if full_path.is_relative_to(src_path_obj):
-                        rel = full_path.relative_to(src_path_obj)
-                        target_root = self.config.paths['target'] / tgt_map
-                        rel_path = rel
-                        matched_map = True
-                        break
-
-                if not matched_map:
-                    continue
-            else:
-                rel_path = full_path.relative_to("/")
-
-            item['rel_path'] = rel_path
-            item['target_root'] = target_root
-            results[str(item['id'])] = item
-
-        return results
-
-    def _format_title_with_year(self, guess: dict) -> str:
-        return f"{guess['title']} ({guess['year']})" if 'year' in guess else guess['title']
-
-    def _format_sub_lang_suffix(self, guess: dict) -> str:
-        if 'subtitle_language' in guess:
-            lang = str(guess['subtitle_language'])
-            return f".{lang[:2].lower()}"
-        return ""
-
-    def _get_dest_path(self, item_path: Path) -> Path:
-        if not self.config.behavior['guessit']:
-            return Path(item_path)
-
+        # Events from here on will be picked up by the next incremental scan
+        self._mark_events()
+
+        # Listing pages are consumed as they arrive, only folders and matching files are kept
+        folders = {}
+        self.scan_plan.reset()
+        # Directories removed locally since the last full scan are created again
+        self.dirs.clear()
+        if self.inventory:
+            # Already indexed or kept current by the watcher, so they aren't probed again
+            self.dirs.update(self.inventory.directories)
         try:
-            guess = dict(guessit(str(item_path)))
-
-            media_type = guess.get('type')
-            container = guess.get('container')
-
-            if media_type == 'episode':
-                title = guess['title']
-                season_num = str(guess.get('season')).zfill(2)
-                episode_num = str(guess.get('episode')).zfill(2)
-
-                show_dir = self._format_title_with_year(guess)
-                season_dir = f"Season {season_num}"
-
-                ep_name = f"{title} - S{season_num}E{episode_num}"
-                if 'episode_title' in guess:
-                    ep_name += f" - {guess['episode_title']}"
-                ep_name += self._format_sub_lang_suffix(guess)
-                ep_name += f".{container}"
-
-                return Path(show_dir, season_dir, ep_name)
-
-            if media_type == 'movie':
-                movie = self._format_title_with_year(guess)
-                movie += self._format_sub_lang_suffix(guess)
-                movie += f".{container}"
-                return Path(movie)
-
+            with metrics.timer("putio_scan_seconds", mode="full"):
+                results = self.scan_plan.filter_items(self.client.list_files(), folders)
         except Exception:
-            pass
+            # The next pass starts over with a full scan
+            self.last_event_id = None
+            return None
+        self.folders = folders
+        self.last_full_scan = time.monotonic()
+        metrics.set_gauge("putio_scan_items", len(results))
 
-        return Path(item_path)
+        return results
 
-    def _process_files(self, files: Dict[str, Dict], label: str):
+    def _collect_orphans(self, files: Dict[str, FileRecord]):
+        """Discards journaled downloads whose file is gone from put.io, along with their partial files."""
+        if not self.state: return
+        known_ids = {item.id for item in files.values()}
+        for file_id, transfer in self.state.transfers().items():
+            if file_id in known_ids: continue
+            try:
+                self.downloader.discard(transfer.gid, Path(transfer.dest_path))
+            except OSError as e:
+                log.warning(f"Could not remove unfinished download {transfer.dest_path}: {e}")
+            self.state.clear_transfer(file_id)
+
+    def _scan_changes(self) -> Optional[Dict[str, FileRecord]]:
+        """
+        Returns only the items added since the last scan, using the put.io events feed.
+        Returns None when a full scan is needed instead.
+        """
+        if self.last_event_id is None: return None
+
+        events = self.client.list_events()
+        if events is None: return None
+
+        new_events = [e for e in events if e.get('id', 0) > self.last_event_id]
+        if not new_events: return {}
+
+        # The whole page is new, so older events may have been missed
+        if len(new_events) == len(events):
+            log.debug("Events feed has a gap since the last scan, falling back to a full scan.")
+            return None
+
+        items = []
+        # Newest first, so the first event for a file tells whether it's still there
+        latest = {}
+        for e in new_events:
+            if e.get('file_id'):
+                latest.setdefault(e['file_id'], e.get('type'))
+        for file_id, event_type in latest.items():
+            if event_type in REMOVAL_EVENTS: continue
+            items.extend(self.client.list_subtree(file_id))
+        # Only once every subtree is listed, so a failure retries these events
+        self.last_event_id = max(e['id'] for e in new_events)
+
+        self._add_folders(items)
+        log.debug(f"Incremental scan: {len(new_events)} events, {len(items)} items.")
+        return self.scan_plan.filter_items(items, self.folders)
+
+    def _mark_events(self):
+        if self.config.behavior['sync_mode'] != 'incremental': return
+        events = self.client.list_events()
+        if events is None:
+            self.last_event_id = None
+        else:
+            self.last_event_id = max((e.get('id', 0) for e in events), default=0)
+
+    def _add_folders(self, items: List[FileRecord]):
+        """Adds new folders to the known tree, fetching any ancestors that aren't known yet."""
+        for item in items:
+            if item.file_type == 'FOLDER':
+                self.folders[item.id] = item
+
+        for item in items:
+            parent_id = item.parent_id
+            while parent_id > 0 and parent_id not in self.folders:
+                parent = self.client.get_file(parent_id)
+                if not parent: break
+                self.folders[parent.id] = parent
+                parent_id = parent.parent_id
+
+    def _resolve_dest(self, item: FileRecord) -> Path:
+        """Returns the sanitized local destination for an item, creating its parent directories."""
+        item_path = self.renamer.rename(item.rel_path)
+        item_path = Path(*[sanitize_filename(part) for part in item_path.parts])
+        dest_path = item.target_root.joinpath(item_path)
+        self.dirs.ensure(dest_path.parent)
+        return dest_path
+
+    def _process_files(self, files: Dict[str, FileRecord], label: str):
         if not files: return
         console.print(f"\n[blue][bold]---[/bold] {label} [bold]---[/blue]")
 
-        # Sort by path
-        sorted_files = sorted(files.values(), key=lambda x: str(x['rel_path']))
+        sorted_files = self.scheduler.order(list(files.values()))
 
-        processed_ids = []
+        # Synced files are skipped before they're renamed, so only the others are parsed
+        synced = self.state.get if self.state else lambda file_id: None
+        self.renamer.prefetch(item.rel_path for item in sorted_files if not synced(item.id))
 
-        for item in sorted_files:
-            if self.exit_event.is_set(): break
-
-            try:
-                item_path = self._get_dest_path(item['rel_path'])
-                item_path = Path(*[sanitize_filename(part) for part in item_path.parts])
-                dest_path = item['target_root'].joinpath(item_path)
-                self._ensure_dir(dest_path.parent)
-
-                url = self.client.get_file_url(item['id'])
-                if not url:
-                    log.error(f"Could not get download URL for {item['name']}")
-                    continue
-
-                file_size = item['size']
-                sha1 = item.get('sha1')
-
-                success = False
-                if dest_path.exists() and sha1:
-                    log.info(f"File {dest_path.name} exists, verifying existing SHA-1...")
-                    if verify_sha1(dest_path, sha1):
-                        log.info(f"SHA-1 match for {dest_path.name}. Skipping download.")
-                        success = True
-
-                if not success:
-                    success = self.downloader.download(url, dest_path, file_size, self.exit_event, sha1)
-
-                if success:
-                    apply_permissions(dest_path, True,
-                        self.config.permissions['target_uid'],
-                        self.config.permissions['target_gid'],
-                        self.config.permissions['target_fmode'],
-                        self.config.permissions['target_dmode'])
-
-                    if self.config.behavior['action'] == 'move':
-                        processed_ids.append(item['id'])
+        with metrics.timer("putio_batch_seconds"):
+            self._run_pipeline(sorted_files)
 
-            except Exception as e:
-                log.error(f"Error processing {item.get('name')}: {e}")
+    def _run_pipeline(self, sorted_files: List[FileRecord]):
+        pipeline = DownloadPipeline(self.config, self.client, self.downloader, self.exit_event, self._resolve_dest, self.state, self.tuner, self.dirs, self.inventory, self.bandwidth)
+        processed_ids = pipeline.run(sorted_files)
+        log.debug(f"Filesystem calls so far: {dict(fs_calls)}")
 
         # Cleanup
         if processed_ids:
@@ -238,14 +278,42 @@ class Application:
             if self.config.behavior['empty_trash']:
                 self.client.empty_trash()
 
+    def _refresh_mirrors(self):
+        """Re-benchmarks mirrors that have had no benchmark or live transfer figures within benchmark_ttl."""
+        if not self.scoreboard: return
+        stale = self.scoreboard.stale()
+        if not stale: return
+
+        from .mirrors import benchmark_mirrors, save_benchmarks
+        log.info(f"Re-benchmarking {len(stale)} mirrors with expired results...")
+        self.scoreboard.seed(asyncio.run(benchmark_mirrors(self.config, stale)), time.time())
+        save_benchmarks(self.config, self.scoreboard.snapshot())
+
     def _run_daemon(self):
         console.print("\n[blue][bold]---[/bold] Daemon Started [bold]---[/bold][/blue]")
+        # A profiled daemon stops on its own, so the report covers a known number of passes
+        iterations = self.config.general['profile_iterations'] if self.config.general['profile'] else 0
         while not self.exit_event.is_set():
             self.exit_event.wait(self.config.behavior['poll_interval'])
             if self.exit_event.is_set(): break
 
             try:
-                current = self._scan_files()
+                self._refresh_mirrors()
+
+                changes = None
+                full_scan_due = time.monotonic() - self.last_full_scan >= self.config.behavior['full_scan_interval']
+                if self.config.behavior['sync_mode'] == 'incremental' and not full_scan_due:
+                    with metrics.timer("putio_scan_seconds", mode="incremental"):
+                        changes = self._scan_changes()
+
+                if changes is None:
+                    current = self._scan_files()
+                    if current is None:
+                        raise RuntimeError("full scan failed, trying again next poll")
+                    self._collect_orphans(current)
+                else:
+                    current = {**self.known_files, **changes}
+
                 new_ids = set(current.keys()) - set(self.known_files.keys())
                 if new_ids:
                     new_items = {k: current[k] for k in new_ids}
@@ -254,3 +322,9 @@ class Application:
                 self.known_files = current
             except Exception as e:
                 log.error(f"Daemon error: {e}")
+
+            if iterations:
+                iterations -= 1
+                if not iterations:
+                    log.info("Profiled iterations done, stopping.")
+                    break
@@ -1,32 +1,169 @@
 import time
+import shutil
 import subprocess
 import logging
-import aria2p
+import threading
 from importlib.metadata import version
 from urllib.parse import urlparse, urlunparse
 from pathlib import Path
-from rich.progress import (
-    Progress,
-    TextColumn,
-    BarColumn,
-    TaskProgressColumn,
-    TimeRemainingColumn,
-    TransferSpeedColumn,
-    DownloadColumn
-)
+from typing import Dict, List, NamedTuple, Optional
 from .config import Config
+from .mirrors import MirrorScoreboard
+from .utils import DirectoryCache
 
 log = logging.getLogger("rich")
 
 
+class DownloadStatus(NamedTuple):
+    gid: str
+    status: str  # active, waiting, paused, complete, error or removed
+    total: int
+    completed: int
+    speed: int
+    error: str = ""
+
+
 class Downloader:
-    def __init__(self, config: Config, sorted_mirrors: list[dict] = None):
+    """
+    Base class for download engines. Engines queue transfers without blocking
+    and report their progress by GID, so one caller can drive many at once.
+    """
+
+    def __init__(self, config: Config, scoreboard: Optional[MirrorScoreboard] = None):
         self.config = config
-        self.sorted_mirrors = sorted_mirrors or []
-        self.aria2: aria2p.API = None
+        self.scoreboard = scoreboard
+        # Changed at runtime when auto-tuning
+        self.max_segments = config.download['max_segments']
+        # Set by the application, so a destination folder removed since it was cached is created again
+        self.dirs: Optional[DirectoryCache] = None
+        # Extra transfers for small files, on top of the concurrency limit
+        self.bypass_slots = config.download['small_file_slots'] if config.download['small_file_size_bytes'] else 0
+        # Set by engines whenever a transfer stops, so callers don't have to wait out a poll.
+        # Callers may set it too, to wake a wait() for their own reasons.
+        self.changed = threading.Event()
+
+    def submit(self, url: str, dst_path: Path, file_size: int, sha1: str = None) -> str:
+        """Queues a download and returns its GID without waiting for it."""
+        raise NotImplementedError
+
+    def status(self, gids: List[str]) -> Dict[str, DownloadStatus]:
+        """Returns the current status of each GID. Unknown GIDs are reported as removed."""
+        raise NotImplementedError
+
+    def finish(self, gid: str, dst_path: Path):
+        """Forgets a stopped download and removes its control file."""
+        raise NotImplementedError
+
+    def cancel(self, gid: str):
+        raise NotImplementedError
+
+    def attach(self, gid: str, dst_path: Path) -> bool:
+        """Picks up a download started before a restart. Returns False if it has to be submitted again."""
+        return False
+
+    def discard(self, gid: str, dst_path: Path):
+        """Cancels a download that is no longer wanted and deletes its partial files."""
+        self.cancel(gid)
+        for suffix in (".aria2", ".part", ".putio"):
+            control_path = dst_path.with_suffix(dst_path.suffix + suffix)
+            if not control_path.exists(): continue
+            # aria2 writes straight to the destination, next to its control file
+            if suffix == ".aria2" and dst_path.exists():
+                dst_path.unlink()
+            control_path.unlink()
+            log.info(f"Removed unfinished download: {dst_path.name}")
+
+    def close(self):
+        pass
+
+    def set_concurrency(self, count: int):
+        """Lets the engine run up to count downloads at once."""
+        pass
+
+    def set_rate_limit(self, limit: int):
+        """Caps the combined speed of all downloads in bytes per second, 0 for no limit."""
+        pass
+
+    def wait(self, timeout: float) -> bool:
+        """Blocks until a transfer stops, changed is set otherwise, or timeout passes. Returns whether it was set."""
+        stopped = self.changed.wait(timeout)
+        self.changed.clear()
+        return stopped
+
+    def segments_for(self, file_size: int) -> int:
+        segments = 1
+        if file_size > 0:
+            possible_segments = file_size // self.config.download['min_segment_size_bytes']
+            segments = max(1, min(self.max_segments, possible_segments))
+        return segments
+
+    def _build_uris(self, primary_url):
+        # Ranked on every call, so the order follows live transfer speeds
+        sorted_mirrors = self.scoreboard.ranked() if self.scoreboard else []
+
+        mirrors = []
+        if self.config.mirrors['enabled']:
+            parsed_url = urlparse(primary_url)
+
+            # mirrors map from config
+            mirror_list = sorted_mirrors if self.scoreboard else [{'name': k, 'code': v} for k, v in self.config.mirrors['map'].items()]
+
+            for mirror_info in mirror_list:
+                code = mirror_info['code']
+                host = f"{code}.put.io"
+                if parsed_url.netloc == host: continue
+
+                mirror_url = urlunparse((
+                    parsed_url.scheme, host, parsed_url.path,
+                    parsed_url.params, parsed_url.query, parsed_url.fragment
+                ))
+                mirrors.append(mirror_url)
+
+        # Optimize order
+        uris = [primary_url] + mirrors
+        if sorted_mirrors and self.config.mirrors['enabled']:
+            best_mirror = sorted_mirrors[0]
+            best_host = f"{best_mirror['code']}.put.io"
+            parsed_primary = urlparse(primary_url)
+
+            if parsed_primary.netloc != best_host:
+                log.debug(f"Using fastest mirror ({best_mirror['name']}) as primary.")
+                best_mirror_url = urlunparse((
+                    parsed_primary.scheme, best_host, parsed_primary.path,
+                    parsed_primary.params, parsed_primary.query, parsed_primary.fragment
+                ))
+                mirrors = [m for m in mirrors if m != best_mirror_url]
+                uris = [best_mirror_url, primary_url] + mirrors
+
+        return uris
+
+
+class Aria2Downloader(Downloader):
+    """
+    Downloads through an aria2 daemon over JSON-RPC, starting one if none is running.
+    Stops are picked up from aria2's WebSocket notifications by one listener thread,
+    and progress for all transfers is read with a single tellActive call.
+    """
+    STATUS_KEYS = ["gid", "status", "totalLength", "completedLength", "downloadSpeed", "errorMessage"]
+    SERVERS_INTERVAL = 2  # seconds between download speed samples for the mirror scoreboard
+
+    def __init__(self, config: Config, scoreboard: Optional[MirrorScoreboard] = None):
+        super().__init__(config, scoreboard)
+        self.aria2: "aria2p.API" = None
         self._init_aria2()
 
+        self._lock = threading.Lock()
+        self._stopped = set()  # GIDs aria2 reported as stopped, until their status is read
+        self._servers_sampled = 0.0
+        self._rate_limit = 0  # last overall limit applied, speeds under one say nothing about the mirror
+        self._listening = True
+        self._listener = threading.Thread(target=self._listen, name="aria2-notifications", daemon=True)
+        self._listener.start()
+
     def _init_aria2(self):
+        # Only loaded with this engine, aria2p brings requests and websocket-client along
+        import aria2p
+
         try:
             self.aria2 = aria2p.API(
                 aria2p.Client(
@@ -39,20 +176,25 @@ class Downloader:
             log.info("Connected to existing downloader daemon.")
         except Exception:
             log.info("Starting internal downloader daemon...")
+            session_file = self.config.paths['session_file']
             cmd = [
                 "aria2c",
                 "--enable-rpc",
                 "--rpc-listen-all=false",
                 "--rpc-listen-port=6800",
                 "--daemon",
-                f"--max-concurrent-downloads={self.config.download['max_concurrent']}",
+                f"--max-concurrent-downloads={self.config.download['max_concurrent'] + self.bypass_slots}",
                 "--max-connection-per-server=16",
                 "--split=16",
                 "--continue=true",
                 f"--user-agent=putio-get/{version('putio-get')}"
             ]
+            if session_file:
+                # Downloads are restored with their GIDs, for attach() to find
+                cmd += [f"--save-session={session_file}", "--save-session-interval=10"]
+                if session_file.exists():
+                    cmd.append(f"--input-file={session_file}")
             subprocess.run(cmd, check=True)
-            time.sleep(1)
             self.aria2 = aria2p.API(
                 aria2p.Client(
                     host="http://localhost",
@@ -61,16 +203,28 @@ class Downloader:
                 )
             )
 
-    def download(self, url: str, dst_path: Path, file_size: int, exit_event, sha1: str = None) -> bool:
-        segments = 1
-        if file_size > 0:
-            possible_segments = file_size // self.config.download['min_segment_size_bytes']
-            segments = max(1, min(self.config.download['max_segments'], possible_segments))
+            # Wait for the RPC interface instead of sleeping a fixed time
+            deadline = time.monotonic() + 10
+            while True:
+                try:
+                    self.aria2.client.get_version()
+                    break
+                except Exception:
+                    if time.monotonic() > deadline: raise
+                    time.sleep(0.05)
+
+    def submit(self, url: str, dst_path: Path, file_size: int, sha1: str = None) -> str:
+        """Queues a download in aria2 and returns its GID without waiting for it."""
+        segments = self.segments_for(file_size)
 
         log.info(f"Downloading: {dst_path.name} (Size: {file_size/1024/1024:.2f} MB, Segments: {segments})")
 
         uris = self._build_uris(url)
 
+        # aria2 would create a missing folder itself, without the configured permissions
+        if self.dirs and not dst_path.parent.is_dir():
+            self.dirs.recreate(dst_path.parent)
+
         options = {
             "dir": str(dst_path.parent),
             "out": dst_path.name,
@@ -79,107 +233,163 @@ class Downloader:
             "allow-overwrite": "true"
         }
 
+        # aria2 verifies the checksum once the download completes. check-integrity is left off,
+        # since existing files are already verified (and cached) before they reach aria2.
         if sha1:
-            options["check-integrity"] = "true"
             options["checksum"] = f"sha-1={sha1}"
 
-        try:
-            # Aria2 returns GID or Download object depending on version/mock
-            new_download = self.aria2.add_uris(uris, options=options)
+        return self.aria2.client.add_uri(uris, options=options)
 
-            if isinstance(new_download, str):
-                gid = new_download
-                download = self.aria2.get_download(gid)
-            else:
-                download = new_download
-                gid = download.gid
+    def _listen(self):
+        """Wakes wait() on every stop notification, reconnecting if the WebSocket drops."""
+        while self._listening:
+            try:
+                self.aria2.client.listen_to_notifications(
+                    on_download_complete=self._on_stop,
+                    on_download_error=self._on_stop,
+                    on_download_stop=self._on_stop,
+                    timeout=1,
+                    handle_signals=False
+                )
+            except Exception as e:
+                log.debug(f"Downloader notifications failed: {e}")
+            # Until it's back, status() still finds stopped downloads on each poll
+            if self._listening:
+                time.sleep(1)
 
-            self._monitor_download(download, dst_path, exit_event)
-        except Exception as e:
-            log.error(f"Download failed for {dst_path}: {e}")
-            if gid:
-                try: self.aria2.remove([gid])
-                except: pass
-            return False
+    def _on_stop(self, gid: str):
+        with self._lock:
+            self._stopped.add(gid)
+        self.changed.set()
+
+    def close(self):
+        self._listening = False
+        self.aria2.client.stop_listening()
+        self._listener.join(timeout=2)
+        try: self.aria2.client.save_session()
+        except Exception as e: log.debug(f"Could not save downloader session: {e}")
+
+    def set_concurrency(self, count: int):
+        try: self.aria2.client.change_global_option({"max-concurrent-downloads": str(count)})
+        except Exception as e: log.debug(f"Could not change concurrent downloads: {e}")
+
+    def set_rate_limit(self, limit: int):
+        # aria2 splits the overall limit across its active downloads
+        try:
+            self.aria2.client.change_global_option({"max-overall-download-limit": str(limit)})
+            self._rate_limit = limit
+        except Exception as e: log.warning(f"Could not change the download rate limit: {e}")
 
-        if exit_event.is_set():
+    def attach(self, gid: str, dst_path: Path) -> bool:
+        try:
+            s = self.aria2.client.tell_status(gid, keys=["status", "files"])
+        except Exception:
             return False
 
+        files = s.get("files") or [{}]
+        if Path(files[0].get("path", "")) != dst_path:
+            return False
+        if s.get("status") in ("error", "removed"):
+            # Resubmitted with a fresh URL, aria2 continues from the control file
+            self.cancel(gid)
+            return False
+        if s.get("status") == "paused":
+            self.aria2.client.unpause(gid)
         return True
 
-    def _build_uris(self, primary_url):
-        mirrors = []
-        if self.config.mirrors['enabled']:
-            parsed_url = urlparse(primary_url)
+    def status(self, gids: List[str]) -> Dict[str, DownloadStatus]:
+        """
+        Returns the current status of each GID. Unknown GIDs are reported as removed.
+        Running and queued downloads are read in one call each, only stopped ones one by one.
+        """
+        keys = self.STATUS_KEYS
+        found = {}
+        try:
+            found = {s["gid"]: s for s in self.aria2.client.tell_active(keys=keys)}
+            with self._lock:
+                stopped = set(self._stopped)
+            if any(gid not in found and gid not in stopped for gid in gids):
+                found.update((s["gid"], s) for s in self.aria2.client.tell_waiting(0, 1000, keys=keys))
+        except Exception as e:
+            log.debug(f"Could not list downloads: {e}")
 
-            # mirrors map from config
-            mirror_list = self.sorted_mirrors if self.sorted_mirrors else [{'name': k, 'code': v} for k, v in self.config.mirrors['map'].items()]
+        now = time.monotonic()
+        sample_servers = (self.scoreboard and not self._rate_limit
+                          and now - self._servers_sampled >= self.SERVERS_INTERVAL)
+        if sample_servers:
+            self._servers_sampled = now
 
-            for mirror_info in mirror_list:
-                code = mirror_info['code']
-                host = f"{code}.put.io"
-                if parsed_url.netloc == host: continue
+        results = {}
+        for gid in gids:
+            s = found.get(gid)
+            if s is None:
+                try:
+                    s = self.aria2.client.tell_status(gid, keys=keys + ["files"])
+                except Exception as e:
+                    log.debug(f"Could not get status for {gid}: {e}")
+                    results[gid] = DownloadStatus(gid, "removed", 0, 0, 0, str(e))
+                    continue
+                finally:
+                    with self._lock:
+                        self._stopped.discard(gid)
+            if sample_servers and s.get("status") == "active":
+                self._record_servers(gid)
+            if self.scoreboard and s.get("status") == "error":
+                self._record_error(s)
+            results[gid] = DownloadStatus(
+                gid,
+                s.get("status", "removed"),
+                int(s.get("totalLength", 0)),
+                int(s.get("completedLength", 0)),
+                int(s.get("downloadSpeed", 0)),
+                s.get("errorMessage", "")
+            )
+        return results
 
-                mirror_url = urlunparse((
-                    parsed_url.scheme, host, parsed_url.path,
-                    parsed_url.params, parsed_url.query, parsed_url.fragment
-                ))
-                mirrors.append(mirror_url)
+    def _record_servers(self, gid: str):
+        """Feeds the speed an active download gets from each mirror, over all its connections, to the mirror scoreboard."""
+        speeds: Dict[str, int] = {}
+        try:
+            for file in self.aria2.client.get_servers(gid):
+                for server in file.get("servers", []):
+                    host = urlparse(server["currentUri"]).netloc
+                    speeds[host] = speeds.get(host, 0) + int(server["downloadSpeed"])
+        except Exception as e:
+            log.debug(f"Could not get servers for {gid}: {e}")
+        for host, speed in speeds.items():
+            self.scoreboard.record_speed(host, speed)
 
-        # Optimize order
-        uris = [primary_url] + mirrors
-        if self.sorted_mirrors and self.config.mirrors['enabled']:
-            best_mirror = self.sorted_mirrors[0]
-            best_host = f"{best_mirror['code']}.put.io"
-            parsed_primary = urlparse(primary_url)
+    def _record_error(self, s: dict):
+        """Counts a failed download against the mirror it was using, or its first URI."""
+        uris = ((s.get("files") or [{}])[0]).get("uris") or []
+        used = [u["uri"] for u in uris if u.get("status") == "used"] or [u["uri"] for u in uris]
+        if used:
+            self.scoreboard.record_error(urlparse(used[0]).netloc)
 
-            if parsed_primary.netloc != best_host:
-                log.info(f"Using fastest mirror ({best_mirror['name']}) as primary.")
-                best_mirror_url = urlunparse((
-                    parsed_primary.scheme, best_host, parsed_primary.path,
-                    parsed_primary.params, parsed_primary.query, parsed_primary.fragment
-                ))
-                mirrors = [m for m in mirrors if m != best_mirror_url]
-                uris = [best_mirror_url, primary_url] + mirrors
+    def finish(self, gid: str, dst_path: Path):
+        """Clears a stopped download from aria2 and removes its control file."""
+        try: self.aria2.client.remove_download_result(gid)
+        except Exception: pass
+        aria2_file = dst_path.with_suffix(dst_path.suffix + ".aria2")
+        if aria2_file.exists():
+            aria2_file.unlink()
 
-        return uris
+    def cancel(self, gid: str):
+        try: self.aria2.client.force_remove(gid)
+        except Exception: pass
+        try: self.aria2.client.remove_download_result(gid)
+        except Exception: pass
 
-    def _monitor_download(self, download, dst_path, exit_event):
-        progress = Progress(
-            TextColumn("[bold blue]{task.description}"),
-            BarColumn(),
-            TaskProgressColumn(),
-            DownloadColumn(),
-            TransferSpeedColumn(),
-            TimeRemainingColumn(),
-            transient=True,
-            refresh_per_second=2
-        )
-
-        with progress:
-            task_id = progress.add_task(f"Downloading: {dst_path.name}", total=None)
-            while not exit_event.is_set():
-                download.update()
-                status = download.status
-
-                if status == "active":
-                    if download.total_length > 0:
-                        progress.update(task_id, total=download.total_length, completed=download.completed_length, speed=download.download_speed)
-                elif status == "complete":
-                    progress.update(task_id, total=download.total_length, completed=download.completed_length)
-                    log.info(f"Download complete: {dst_path.name}")
-                    download.remove()
-                    # Cleanup .aria2 file
-                    aria2_file = dst_path.with_suffix(dst_path.suffix + ".aria2")
-                    if aria2_file.exists():
-                        aria2_file.unlink()
-                    break
-                elif status == "error":
-                    log.error(f"Aria2 error for {dst_path.name}: {download.error_message}")
-                    download.remove()
-                    raise Exception(f"Aria2 download failed: {download.error_message}")
-                elif status == "removed":
-                    log.warning(f"Download removed externally: {dst_path.name}")
-                    break
 
-                time.sleep(1)
+def create_downloader(config: Config, scoreboard: Optional[MirrorScoreboard] = None) -> Downloader:
+    """Returns the configured download engine. 'auto' uses aria2 when aria2c is installed."""
+    engine = config.download['engine']
+    if engine == 'auto':
+        engine = 'aria2' if shutil.which('aria2c') else 'native'
+
+    if engine == 'native':
+        from .native import NativeDownloader
+        log.info("Using the built-in downloader.")
+        return NativeDownloader(config, scoreboard)
+
+    return Aria2Downloader(config, scoreboard)
@@ -0,0 +1,156 @@
+import os
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, NamedTuple, Optional, Set
+
+log = logging.getLogger("rich")
+
+
+class FileInfo(NamedTuple):
+    """The parts of os.stat_result the sync compares, under the same names."""
+    st_size: int
+    st_mtime_ns: int
+    st_ino: int
+
+
+class LocalInventory:
+    """
+    Files and directories under the target roots, read in one os.scandir walk, so
+    existence checks for many items are dictionary lookups instead of a stat each.
+    Kept up to date as files land, and optionally by a filesystem watcher.
+    """
+
+    def __init__(self, roots: Iterable[Path]):
+        self.roots = sorted(set(roots))
+        self.files: Dict[str, FileInfo] = {}
+        self.directories: Set[Path] = set()
+        self._lock = threading.Lock()
+        self._observer = None
+
+    def build(self):
+        files, directories = self._walk(self.roots)
+        with self._lock:
+            self.files = files
+            self.directories = directories
+        log.info(f"Indexed {len(files)} local files in {len(directories)} directories")
+
+    def add_tree(self, path: Path):
+        """Indexes a directory that appeared, such as one moved into the target."""
+        files, directories = self._walk([path])
+        with self._lock:
+            self.files.update(files)
+            self.directories.update(directories)
+
+    def _walk(self, roots: Iterable[Path]):
+        """
+        Walks the roots like Path.exists() sees them, through symlinked directories too.
+        Each directory carries the (st_dev, st_ino) of its ancestors, so a link back up is only entered once.
+        """
+        files: Dict[str, FileInfo] = {}
+        directories: Set[Path] = set()
+        stack = []
+        for root in roots:
+            try:
+                st = os.stat(root)
+            except OSError:
+                continue
+            stack.append((str(root), frozenset({(st.st_dev, st.st_ino)})))
+        while stack:
+            current, ancestors = stack.pop()
+            try:
+                with os.scandir(current) as entries:
+                    directories.add(Path(current))
+                    for entry in entries:
+                        try:
+                            if entry.is_dir():
+                                st = entry.stat()
+                                key = (st.st_dev, st.st_ino)
+                                if key in ancestors:
+                                    log.debug(f"Skipping {entry.path}: links back to a parent directory")
+                                    continue
+                                stack.append((entry.path, ancestors | {key}))
+                            elif entry.is_file():
+                                st = entry.stat()
+                                files[entry.path] = FileInfo(st.st_size, st.st_mtime_ns, st.st_ino)
+                        except OSError as e:
+                            log.debug(f"Skipping {entry.path}: {e}")
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                log.warning(f"Could not list {current}: {e}")
+        return files, directories
+
+    def get(self, path: Path) -> Optional[FileInfo]:
+        return self.files.get(str(path))
+
+    def exists(self, path: Path) -> bool:
+        return str(path) in self.files
+
+    def add(self, path: Path):
+        """Records a file that just landed, or drops it if it's gone."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.remove(path)
+            return
+        with self._lock:
+            self.files[str(path)] = FileInfo(st.st_size, st.st_mtime_ns, st.st_ino)
+            self.directories.add(path.parent)
+
+    def remove(self, path: Path):
+        with self._lock:
+            self.files.pop(str(path), None)
+
+    def remove_tree(self, path: Path):
+        prefix = str(path) + os.sep
+        with self._lock:
+            self.files = {p: info for p, info in self.files.items() if not p.startswith(prefix)}
+            self.directories = {d for d in self.directories if d != path and not d.is_relative_to(path)}
+
+    def watch(self) -> bool:
+        """Keeps the inventory fresh from filesystem events. Returns False if watchdog isn't installed."""
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            log.warning("watchdog is not installed, the local inventory is only used for the first run.")
+            return False
+
+        inventory = self
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if event.event_type in ("opened", "closed_no_write"): return
+                src = Path(os.fsdecode(event.src_path))
+                if event.event_type in ("deleted", "moved"):
+                    if event.is_directory:
+                        inventory.remove_tree(src)
+                    else:
+                        inventory.remove(src)
+                if event.event_type == "moved":
+                    dest = Path(os.fsdecode(event.dest_path))
+                    if event.is_directory:
+                        inventory.add_tree(dest)
+                    else:
+                        inventory.add(dest)
+                elif event.event_type != "deleted" and not event.is_directory:
+                    inventory.add(src)
+
+        self._observer = Observer()
+        for root in self.roots:
+            if root.is_dir():
+                self._observer.schedule(Handler(), str(root), recursive=True)
+        self._observer.start()
+        log.info("Watching the target directory for changes.")
+        return True
+
+    @property
+    def watching(self) -> bool:
+        return self._observer is not None
+
+    def close(self):
+        if self._observer:
+            self._observer.stop()
+            self._observer.join(timeout=5)
+            self._observer = None
@@ -0,0 +1,193 @@
+import time
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+log = logging.getLogger("rich")
+
+# Histogram buckets in seconds, from a fast API call to a long download
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+
+DESCRIPTIONS = {
+    "putio_api_request_seconds": "put.io API request latency by endpoint",
+    "putio_api_errors_total": "put.io API requests that failed, by endpoint",
+    "putio_scan_seconds": "Time spent listing put.io, by scan mode",
+    "putio_scan_items": "Matching files found by the last scan",
+    "putio_batch_seconds": "Time spent processing a batch of files",
+    "putio_resolve_seconds": "Time to check a file's sync state and resolve its destination",
+    "putio_guessit_seconds": "Time spent parsing file names with guessit",
+    "putio_url_fetch_seconds": "Time to get a download URL",
+    "putio_queue_wait_seconds": "Time a file waited for a download slot with its URL ready",
+    "putio_download_seconds": "Time from submission to the end of a download, by result",
+    "putio_downloaded_bytes_total": "Bytes of completed downloads",
+    "putio_mirror_speed_bytes": "Current speed estimate of each mirror in bytes per second",
+    "putio_hash_seconds": "Time spent hashing local files",
+    "putio_hashed_bytes_total": "Bytes read to hash local files",
+    "putio_hash_cache_hits_total": "Local files whose SHA-1 came from the checksum cache",
+    "putio_move_seconds": "Time to move a staged file into the target",
+    "putio_permissions_seconds": "Time spent applying permissions to a batch",
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Registry:
+    """Counters, gauges and histograms by name and labels, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.gauges: Dict[str, Dict[Labels, float]] = {}
+        # Per label set: bucket counts, then sum and count
+        self.histograms: Dict[str, Dict[Labels, List[float]]] = {}
+
+    def inc(self, name: str, value: float, labels: Labels):
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[labels] = series.get(labels, 0) + value
+
+    def set(self, name: str, value: float, labels: Labels):
+        with self._lock:
+            self.gauges.setdefault(name, {})[labels] = value
+
+    def observe(self, name: str, value: float, labels: Labels):
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            values = series.get(labels)
+            if values is None:
+                values = series[labels] = [0] * (len(BUCKETS) + 2)
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    values[i] += 1
+            values[-2] += value
+            values[-1] += 1
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for kind, metrics in (("counter", self.counters), ("gauge", self.gauges)):
+                for name, series in sorted(metrics.items()):
+                    self._header(lines, name, kind)
+                    for labels, value in series.items():
+                        lines.append(f"{name}{_format_labels(labels)} {value:g}")
+
+            for name, series in sorted(self.histograms.items()):
+                self._header(lines, name, "histogram")
+                for labels, values in series.items():
+                    for bound, count in zip(BUCKETS, values):
+                        lines.append(f"{name}_bucket{_format_labels(labels + (('le', f'{bound:g}'),))} {count}")
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {values[-1]}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {values[-2]:g}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {values[-1]}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> List[Tuple[str, Labels, int, float]]:
+        """Returns (name, labels, count, total seconds) for every timed series, slowest first."""
+        with self._lock:
+            rows = [(name, labels, int(values[-1]), values[-2])
+                    for name, series in self.histograms.items() for labels, values in series.items()]
+        return sorted(rows, key=lambda row: row[3], reverse=True)
+
+    def _header(self, lines: List[str], name: str, kind: str):
+        if name in DESCRIPTIONS:
+            lines.append(f"# HELP {name} {DESCRIPTIONS[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels: return ""
+    escaped = (f'{k}="{_escape(str(v))}"' for k, v in labels)
+    return "{" + ",".join(escaped) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# None until enabled, every call below returns right away in that case
+registry: Optional[Registry] = None
+
+
+def enable() -> Registry:
+    global registry
+    if registry is None:
+        registry = Registry()
+    return registry
+
+
+def inc(name: str, value: float = 1, **labels):
+    if registry is None: return
+    registry.inc(name, value, tuple(sorted(labels.items())))
+
+
+def set_gauge(name: str, value: float, **labels):
+    if registry is None: return
+    registry.set(name, value, tuple(sorted(labels.items())))
+
+
+def observe(name: str, value: float, **labels):
+    if registry is None: return
+    registry.observe(name, value, tuple(sorted(labels.items())))
+
+
+class _Timer:
+    __slots__ = ("name", "labels", "start")
+
+    def __init__(self, name: str, labels: dict):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+
+class _NoTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NO_TIMER = _NoTimer()
+
+
+def timer(name: str, **labels):
+    """Context manager observing the time spent in its block into a histogram."""
+    if registry is None: return _NO_TIMER
+    return _Timer(name, labels)
+
+
+def serve(host: str, port: int):
+    """Serves /metrics from a background thread."""
+    # Imported here, http.server is slow to load and only needed in daemon mode
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    reg = enable()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = reg.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    log.info(f"Serving metrics on http://{host}:{server.server_port}/metrics")
+    return server
@@ -1,85 +1,216 @@
 import time
 import json
+import asyncio
 import logging
+import threading
 import httpx
+from . import metrics
 from .config import Config
 
 log = logging.getLogger("rich")
 
 
-def benchmark_mirror(name: str, code: str) -> float:
-    """Benchmark a single mirror and return speed in bytes/sec."""
+async def benchmark_mirror(client: httpx.AsyncClient, name: str, code: str, stop: asyncio.Event, live: dict) -> dict:
+    """Benchmark a single mirror and return its speed in bytes/sec and time to first byte in seconds."""
+    result = {'name': name, 'code': code, 'speed': 0.0, 'ttfb': None}
     try:
         target_size = 100 * 1024 * 1024
         url = f"https://{code}.put.io/network.js/server.php?module=download&size={target_size}&network-{int(time.time()*1000)}"
         log.debug(f"Benchmarking {name} ({code})...")
 
-        start_time = time.time()
+        start_time = time.monotonic()
+        first_byte = None
         downloaded = 0
 
-        # We need a short timeout for connection, but reasonable for download
-        with httpx.Client(timeout=10.0) as client:
-            with client.stream("GET", url) as response:
-                response.raise_for_status()
-                for chunk in response.iter_bytes(chunk_size=8192):
-                    downloaded += len(chunk)
-                    elapsed = time.time() - start_time
-                    # Stop if we have enough data or taken too long (e.g. 5 seconds)
-                    if downloaded >= target_size or elapsed > 5:
-                        break
-
-        duration = time.time() - start_time
+        async with client.stream("GET", url) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes(chunk_size=65536):
+                now = time.monotonic()
+                if first_byte is None:
+                    first_byte = now
+                    result['ttfb'] = first_byte - start_time
+                downloaded += len(chunk)
+                live[code] = downloaded / max(now - first_byte, 0.001)
+                # Stop if we have enough data, taken too long (e.g. 5 seconds)
+                # or the ranking has settled and this mirror has had a fair sample
+                if downloaded >= target_size or now - start_time > 5:
+                    break
+                if stop.is_set() and now - first_byte >= 2:
+                    break
+
+        # Throughput is measured from the first byte, so latency doesn't skew it
+        duration = time.monotonic() - (first_byte or start_time)
         if duration == 0: duration = 0.001
-        speed = downloaded / duration
-        log.info(f"Mirror {name}: {speed/1024/1024:.2f} MB/s")
-        return speed
+        result['speed'] = downloaded / duration
+        ttfb = f"{result['ttfb']*1000:.0f} ms" if result['ttfb'] is not None else "-"
+        log.info(f"Mirror {name}: {result['speed']/1024/1024:.2f} MB/s (TTFB: {ttfb})")
     except Exception as e:
         log.warning(f"Failed to benchmark {name} ({code}): {e}")
-        return 0.0
+    finally:
+        live.pop(code, None)
+
+    return result
 
 
-def get_mirror_rankings(config: Config) -> list[dict]:
+async def benchmark_mirrors(config: Config, codes: list[str] = None) -> list[dict]:
     """
-    Returns a sorted list of mirrors [{'name': name, 'code': code, 'speed': speed}].
+    Benchmarks all mirrors, or only the given mirror codes, concurrently. At most benchmark_concurrency probes run at once,
+    each started benchmark_stagger seconds after the previous one so they don't all compete
+    for our own link at the same moment. Probes end early once the order of the running
+    mirrors has stayed the same for a couple of seconds.
+    """
+    semaphore = asyncio.Semaphore(max(1, config.mirrors['benchmark_concurrency']))
+    stagger = config.mirrors['benchmark_stagger']
+    stop = asyncio.Event()
+    live = {}
+
+    async def probe(index, name, code):
+        await asyncio.sleep(index * stagger)
+        async with semaphore:
+            return await benchmark_mirror(client, name, code, stop, live)
+
+    async def watch_ranking():
+        last_order, stable_since = None, time.monotonic()
+        while True:
+            await asyncio.sleep(0.5)
+            order = sorted(live, key=live.get, reverse=True)
+            if order != last_order:
+                last_order, stable_since = order, time.monotonic()
+            elif len(order) > 1 and time.monotonic() - stable_since >= 2:
+                stop.set()
+            else:
+                stop.clear()
+
+    mirrors = [(name, code) for name, code in config.mirrors['map'].items() if codes is None or code in codes]
+
+    # We need a short timeout for connection, but reasonable for download
+    async with httpx.AsyncClient(timeout=10.0) as client:
+        watcher = asyncio.create_task(watch_ranking())
+        try:
+            return await asyncio.gather(*(probe(i, name, code) for i, (name, code) in enumerate(mirrors)))
+        finally:
+            watcher.cancel()
+
+
+class MirrorScoreboard:
+    """
+    Ranks mirrors by an EWMA of real transfer speeds, seeded with benchmark results. Like a benchmark,
+    each sample is the whole speed one download gets from a mirror, summed over its connections.
+    Mirrors that keep failing are dropped for a while, and results older than benchmark_ttl
+    are reported by stale() so a long running daemon can re-measure them.
+    """
+    ALPHA = 0.2
+    ERROR_LIMIT = 0.5
+    COOLDOWN = 600
+
+    def __init__(self, config: Config, results: list[dict], measured_at: float):
+        self.config = config
+        self._lock = threading.Lock()
+        self._mirrors: dict[str, dict] = {}
+        self._hosts = {f"{code}.put.io": code for code in config.mirrors['map'].values()}
+        self.seed(results, measured_at)
+
+    def seed(self, results: list[dict], measured_at: float):
+        """Replaces the figures for the given mirrors with benchmark results."""
+        min_speed = self.config.mirrors['min_speed_bytes']
+        with self._lock:
+            for r in results:
+                m = self._mirrors.setdefault(r['code'], {'name': r['name'], 'code': r['code'], 'errors': 0.0, 'failed_at': 0.0})
+                m.update(speed=r.get('speed', 0), ttfb=r.get('ttfb'), updated=measured_at)
+                if m['speed'] < min_speed:
+                    log.info(f"Skipping mirror {r['name']} (Speed: {m['speed']/1024/1024:.2f} MB/s < Min: {min_speed/1024/1024:.2f} MB/s)")
+
+    def record_speed(self, host: str, speed: float):
+        """Adds a speed observation for one download from a mirror host, all of its connections together."""
+        code = self._hosts.get(host)
+        if not code or speed <= 0: return
+        with self._lock:
+            m = self._mirrors.get(code)
+            if not m: return
+            m['speed'] = self.ALPHA * speed + (1 - self.ALPHA) * m['speed']
+            m['errors'] *= (1 - self.ALPHA)
+            m['updated'] = time.time()
+            metrics.set_gauge("putio_mirror_speed_bytes", m['speed'], mirror=m['name'])
+
+    def record_error(self, host: str):
+        code = self._hosts.get(host)
+        if not code: return
+        with self._lock:
+            m = self._mirrors.get(code)
+            if not m: return
+            m['errors'] = self.ALPHA + (1 - self.ALPHA) * m['errors']
+            if m['errors'] > self.ERROR_LIMIT and not m['failed_at']:
+                m['failed_at'] = time.time()
+                log.warning(f"Mirror {m['name']} keeps failing, not using it for {self.COOLDOWN // 60} minutes.")
+
+    def ranked(self) -> list[dict]:
+        """
+        Returns a sorted list of usable mirrors [{'name': name, 'code': code, 'speed': speed, 'ttfb': ttfb}].
+        """
+        now = time.time()
+        min_speed = self.config.mirrors['min_speed_bytes']
+        results = []
+        with self._lock:
+            for m in self._mirrors.values():
+                if m['failed_at']:
+                    if now - m['failed_at'] < self.COOLDOWN: continue
+                    m['failed_at'], m['errors'] = 0.0, 0.0
+                if m['speed'] >= min_speed:
+                    results.append({'name': m['name'], 'code': m['code'], 'speed': m['speed'], 'ttfb': m['ttfb']})
+
+        # Sort descending
+        results.sort(key=lambda x: x['speed'], reverse=True)
+        return results
+
+    def stale(self) -> list[str]:
+        """Returns the codes of mirrors with no benchmark or live figures within benchmark_ttl."""
+        cutoff = time.time() - self.config.mirrors['benchmark_ttl']
+        with self._lock:
+            return [m['code'] for m in self._mirrors.values() if m['updated'] < cutoff]
+
+    def snapshot(self) -> list[dict]:
+        """Returns all mirrors in the benchmark file format."""
+        with self._lock:
+            return [{'name': m['name'], 'code': m['code'], 'speed': m['speed'], 'ttfb': m['ttfb']} for m in self._mirrors.values()]
+
+
+def load_benchmarks(config: Config) -> tuple[list[dict], float]:
+    """
+    Returns benchmark results [{'name': name, 'code': code, 'speed': speed, 'ttfb': ttfb}] and when
+    they were measured. Saved results are reused until they are older than benchmark_ttl.
     """
     results = []
+    measured_at = time.time()
+    benchmark_file = config.mirrors['benchmark_file']
 
     should_benchmark = True
-    if not config.mirrors['benchmark_only'] and config.mirrors['benchmark_file'].exists():
+    if not config.mirrors['benchmark_only'] and benchmark_file.exists():
         try:
-            with open(config.mirrors['benchmark_file'], 'r') as f:
-                saved_data = json.load(f)
-                results = saved_data
-                should_benchmark = False
-                log.info(f"Loaded benchmark results from {config.mirrors['benchmark_file']}")
+            measured_at = benchmark_file.stat().st_mtime
+            if time.time() - measured_at > config.mirrors['benchmark_ttl']:
+                log.info(f"Benchmark results in {benchmark_file} have expired. Re-running benchmark.")
+            else:
+                with open(benchmark_file, 'r') as f:
+                    saved_data = json.load(f)
+                    results = saved_data
+                    should_benchmark = False
+                    log.info(f"Loaded benchmark results from {benchmark_file}")
         except Exception as e:
             log.warning(f"Could not load benchmark file: {e}. Re-running benchmark.")
 
     if should_benchmark:
         log.info("Benchmarking mirrors (this may take a moment)...")
-        for name, code in config.mirrors['map'].items():
-            speed = benchmark_mirror(name, code)
-            results.append({'name': name, 'code': code, 'speed': speed})
+        results = asyncio.run(benchmark_mirrors(config))
+        measured_at = time.time()
+        save_benchmarks(config, results)
 
-        try:
-            with open(config.mirrors['benchmark_file'], 'w') as f:
-                json.dump(results, f, indent=2)
-            log.info(f"Saved benchmark results to {config.mirrors['benchmark_file']}")
-        except Exception as e:
-            log.error(f"Failed to save benchmark results: {e}")
-
-    # Filter by speed
-    min_speed = config.mirrors['min_speed_bytes']
-
-    filtered_results = []
-    for r in results:
-        # Check if speed meets requirement
-        s = r.get('speed', 0)
-        if s >= min_speed:
-            filtered_results.append(r)
-        else:
-            log.info(f"Skipping mirror {r['name']} (Speed: {s/1024/1024:.2f} MB/s < Min: {min_speed/1024/1024:.2f} MB/s)")
-
-    # Sort descending
-    filtered_results.sort(key=lambda x: x['speed'], reverse=True)
-    return filtered_results
+    return results, measured_at
+
+
+def save_benchmarks(config: Config, results: list[dict]):
+    try:
+        with open(config.mirrors['benchmark_file'], 'w') as f:
+            json.dump(results, f, indent=2)
+        log.info(f"Saved benchmark results to {config.mirrors['benchmark_file']}")
+    except Exception as e:
+        log.error(f"Failed to save benchmark results: {e}")
@@ -0,0 +1,140 @@
+import os
+import logging
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterable, Optional
+
+from . import metrics
+from .config import Config
+from .state import StateStore
+
+log = logging.getLogger("rich")
+
+# Bumped whenever the naming rules change, so persisted names are computed again
+NAMING_VERSION = 1
+
+# Below this many uncached names, parsing them as they come is faster than starting a pool
+POOL_THRESHOLD = 200
+
+
+def _format_title_with_year(guess: dict) -> str:
+    return f"{guess['title']} ({guess['year']})" if 'year' in guess else guess['title']
+
+
+def _format_sub_lang_suffix(guess: dict) -> str:
+    if 'subtitle_language' in guess:
+        lang = str(guess['subtitle_language'])
+        return f".{lang[:2].lower()}"
+    return ""
+
+
+def guess_name(item_path: str) -> str:
+    """Returns the library path for a file, based on what guessit makes of its put.io path."""
+    # Imported here, guessit takes a while to load and isn't needed when renaming is off
+    from guessit import guessit
+
+    try:
+        guess = dict(guessit(item_path))
+
+        media_type = guess.get('type')
+        container = guess.get('container')
+
+        if media_type == 'episode':
+            title = guess['title']
+            season_num = str(guess.get('season')).zfill(2)
+            episode_num = str(guess.get('episode')).zfill(2)
+
+            show_dir = _format_title_with_year(guess)
+            season_dir = f"Season {season_num}"
+
+            ep_name = f"{title} - S{season_num}E{episode_num}"
+            if 'episode_title' in guess:
+                ep_name += f" - {guess['episode_title']}"
+            ep_name += _format_sub_lang_suffix(guess)
+            ep_name += f".{container}"
+
+            return str(Path(show_dir, season_dir, ep_name))
+
+        if media_type == 'movie':
+            movie = _format_title_with_year(guess)
+            movie += _format_sub_lang_suffix(guess)
+            movie += f".{container}"
+            return movie
+
+    except Exception:
+        pass
+
+    return item_path
+
+
+class Renamer:
+    """
+    Renames files with guessit, caching results by source path in an LRU and,
+    when a state store is given, persisting them so restarts don't parse again.
+    Large batches of new names can be parsed across a process pool with prefetch().
+    """
+
+    def __init__(self, config: Config, state: Optional[StateStore] = None):
+        self.enabled = config.behavior['guessit']
+        self.cache_size = max(1, config.behavior['guessit_cache_size'])
+        self.workers = config.behavior['guessit_workers'] or os.cpu_count() or 1
+        self.state = state
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def rename(self, item_path: Path) -> Path:
+        if not self.enabled:
+            return Path(item_path)
+
+        source = str(item_path)
+        with self._lock:
+            name = self._cache.get(source)
+            if name is not None:
+                self._cache.move_to_end(source)
+                return Path(name)
+
+        name = self.state.get_name(NAMING_VERSION, source) if self.state else None
+        if name is None:
+            with metrics.timer("putio_guessit_seconds"):
+                name = guess_name(source)
+            if self.state:
+                self.state.put_names(NAMING_VERSION, {source: name})
+
+        self._remember(source, name)
+        return Path(name)
+
+    def prefetch(self, item_paths: Iterable[Path]):
+        """Parses uncached names in bulk, across a process pool when there are many."""
+        if not self.enabled: return
+
+        with self._lock:
+            missing = list(dict.fromkeys(str(p) for p in item_paths if str(p) not in self._cache))
+        if self.state:
+            known = self.state.get_names(NAMING_VERSION, missing)
+            for source, name in known.items():
+                self._remember(source, name)
+            missing = [source for source in missing if source not in known]
+
+        if len(missing) < POOL_THRESHOLD or self.workers < 2: return
+
+        log.info(f"Parsing {len(missing)} file names with {self.workers} processes...")
+        # Spawned, the downloader's threads make forking unsafe
+        context = multiprocessing.get_context("spawn")
+        with metrics.timer("putio_guessit_seconds", mode="pool"), \
+                ProcessPoolExecutor(max_workers=self.workers, mp_context=context) as pool:
+            names = dict(zip(missing, pool.map(guess_name, missing, chunksize=64)))
+
+        for source, name in names.items():
+            self._remember(source, name)
+        if self.state:
+            self.state.put_names(NAMING_VERSION, names)
+
+    def _remember(self, source: str, name: str):
+        with self._lock:
+            self._cache[source] = name
+            self._cache.move_to_end(source)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
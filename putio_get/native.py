@@ -0,0 +1,350 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import logging
+import threading
+from importlib.metadata import version
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+import httpx
+
+from .config import Config
+from .downloader import Downloader, DownloadStatus
+from .mirrors import MirrorScoreboard
+from .utils import sha1_file
+
+log = logging.getLogger("rich")
+
+WRITE_SIZE = 256 * 1024  # bytes buffered per segment before each write
+HOSTS_INTERVAL = 2  # seconds between download speed samples for the mirror scoreboard
+
+
+class RangeNotSupported(Exception):
+    pass
+
+
+class _TokenBucket:
+    """
+    Download rate limit shared by every segment, so the limit is split across transfers as they
+    read. Holds at most a second's worth of bytes, and a reader that overdraws it sleeps off the debt.
+    """
+
+    def __init__(self):
+        self.rate = 0  # bytes per second, 0 for no limit
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+
+    async def take(self, size: int):
+        rate = self.rate
+        if not rate: return
+        now = time.monotonic()
+        self.tokens = min(rate, self.tokens + (now - self.updated) * rate) - size
+        self.updated = now
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / rate)
+
+
+class _Transfer:
+    """State of one native download. Segments are [start, end, done], with end exclusive or None if unknown."""
+    __slots__ = ("gid", "dst_path", "part_path", "control_path", "size", "sha1", "uris",
+                 "segments", "status", "error", "future", "speed", "digest", "received", "_sample", "_hosts_sample", "_saved")
+
+    def __init__(self, gid: str, dst_path: Path, size: int, sha1: Optional[str], uris: List[str]):
+        self.gid = gid
+        self.dst_path = dst_path
+        self.part_path = dst_path.with_suffix(dst_path.suffix + ".part")
+        self.control_path = dst_path.with_suffix(dst_path.suffix + ".putio")
+        self.size = size
+        self.sha1 = sha1
+        self.uris = uris
+        self.segments: List[List[Optional[int]]] = []
+        self.status = "waiting"
+        self.error = ""
+        self.future = None
+        self.speed = 0
+        self.digest: Optional[str] = None
+        self.received: Dict[str, int] = {}  # bytes by mirror host, over all segments
+        self._sample = (time.monotonic(), 0)
+        self._hosts_sample = (time.monotonic(), {})
+        self._saved = 0.0
+
+    @property
+    def completed(self) -> int:
+        return sum(seg[2] for seg in self.segments)
+
+    def save_control(self, force: bool = False):
+        """Writes segment progress next to the partial file, at most once a second unless forced."""
+        now = time.monotonic()
+        if not force and now - self._saved < 1: return
+        self._saved = now
+        try:
+            with open(self.control_path, 'w') as f:
+                json.dump({"size": self.size, "sha1": self.sha1, "segments": self.segments}, f)
+        except OSError as e:
+            log.debug(f"Could not save progress for {self.dst_path.name}: {e}")
+
+
+class NativeDownloader(Downloader):
+    """
+    Built-in engine using asyncio and httpx, for hosts without aria2.
+    Files are split into HTTP Range segments like aria2 (max_segments, min_segment_size),
+    written into a preallocated .part file and resumed from a .putio control file.
+    Each segment fails over through the mirror list from _build_uris.
+    """
+
+    def __init__(self, config: Config, scoreboard: Optional[MirrorScoreboard] = None):
+        super().__init__(config, scoreboard)
+        self._transfers: Dict[str, _Transfer] = {}
+        self._lock = threading.Lock()
+        self._bucket = _TokenBucket()
+
+        download = self.config.download
+        if download['auto_tune']:
+            max_connections = download['max_concurrent_limit'] * download['max_segments_limit']
+        else:
+            max_connections = download['max_concurrent'] * download['max_segments']
+        max_connections += self.bypass_slots * download['max_segments']
+        self.http = httpx.AsyncClient(
+            timeout=httpx.Timeout(30.0, connect=10.0),
+            follow_redirects=True,
+            headers={"User-Agent": f"putio-get/{version('putio-get')}"},
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        )
+
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="native-downloader", daemon=True)
+        self._thread.start()
+
+    def submit(self, url: str, dst_path: Path, file_size: int, sha1: str = None) -> str:
+        segments = self.segments_for(file_size)
+        log.info(f"Downloading: {dst_path.name} (Size: {file_size/1024/1024:.2f} MB, Segments: {segments})")
+
+        gid = uuid.uuid4().hex[:16]
+        transfer = _Transfer(gid, dst_path, file_size, sha1, self._build_uris(url))
+        with self._lock:
+            self._transfers[gid] = transfer
+        transfer.future = asyncio.run_coroutine_threadsafe(self._run(transfer, segments), self.loop)
+        return gid
+
+    def status(self, gids: List[str]) -> Dict[str, DownloadStatus]:
+        results = {}
+        now = time.monotonic()
+        for gid in gids:
+            t = self._transfers.get(gid)
+            if not t:
+                results[gid] = DownloadStatus(gid, "removed", 0, 0, 0)
+                continue
+
+            completed = t.completed
+            last_time, last_completed = t._sample
+            if now - last_time >= 0.5:
+                t.speed = int((completed - last_completed) / (now - last_time))
+                t._sample = (now, completed)
+
+            if self.scoreboard and t.status == "active":
+                self._record_hosts(t, now)
+
+            results[gid] = DownloadStatus(gid, t.status, t.size, completed, t.speed, t.error)
+        return results
+
+    def _record_hosts(self, t: _Transfer, now: float):
+        """Feeds the speed a download gets from each mirror, over all its segments, to the mirror scoreboard."""
+        last_time, last_received = t._hosts_sample
+        if now - last_time < HOSTS_INTERVAL: return
+        received = dict(t.received)
+        t._hosts_sample = (now, received)
+        # Throttled speeds say nothing about the mirror
+        if self._bucket.rate: return
+        for host, total in received.items():
+            self.scoreboard.record_speed(host, (total - last_received.get(host, 0)) / (now - last_time))
+
+    def finish(self, gid: str, dst_path: Path):
+        with self._lock:
+            self._transfers.pop(gid, None)
+        control_path = dst_path.with_suffix(dst_path.suffix + ".putio")
+        if control_path.exists():
+            control_path.unlink()
+
+    def cancel(self, gid: str):
+        with self._lock:
+            t = self._transfers.pop(gid, None)
+        if t and t.future:
+            t.future.cancel()
+
+    def set_rate_limit(self, limit: int):
+        # Read by the event loop on the next chunk
+        self._bucket.rate = limit
+
+    def close(self):
+        """Stops all transfers, leaving their partial files and progress for the next run."""
+        try:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop).result(timeout=10)
+        except Exception as e:
+            log.debug(f"Downloader did not shut down cleanly: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=10)
+
+    async def _shutdown(self):
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks: task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.http.aclose()
+
+    async def _run(self, t: _Transfer, segments: int):
+        try:
+            t.status = "active"
+            await asyncio.to_thread(self._prepare, t, segments)
+
+            try:
+                await self._fetch_all(t)
+            except RangeNotSupported:
+                log.info(f"Server does not support ranges for {t.dst_path.name}, using a single connection.")
+                await asyncio.to_thread(self._prepare, t, 1, True)
+                await self._fetch_all(t)
+
+            if t.sha1:
+                # Single streams are hashed on the fly, segmented files are read back once
+                actual = t.digest or await asyncio.to_thread(sha1_file, t.part_path)
+                if actual != t.sha1.lower():
+                    # Start over next time instead of resuming into the same result
+                    t.part_path.unlink()
+                    t.control_path.unlink()
+                    raise Exception(f"SHA-1 mismatch (expected {t.sha1}, got {actual})")
+
+            os.replace(t.part_path, t.dst_path)
+            if t.control_path.exists():
+                t.control_path.unlink()
+            t.status = "complete"
+
+        except asyncio.CancelledError:
+            t.save_control(force=True)
+            t.status = "removed"
+            raise
+        except Exception as e:
+            if t.part_path.exists():
+                t.save_control(force=True)
+            t.error = str(e)
+            t.status = "error"
+        finally:
+            self.changed.set()
+
+    def _prepare(self, t: _Transfer, segments: int, restart: bool = False):
+        """Resumes from the control file when it matches, otherwise preallocates a new part file."""
+        if not restart and t.control_path.exists() and t.part_path.exists():
+            try:
+                with open(t.control_path, 'r') as f:
+                    saved = json.load(f)
+                if saved.get("size") == t.size and saved.get("sha1") == t.sha1 and t.size > 0:
+                    t.segments = saved["segments"]
+                    log.info(f"Resuming {t.dst_path.name} at {t.completed/1024/1024:.2f} MB")
+                    return
+            except (OSError, ValueError, KeyError) as e:
+                log.debug(f"Ignoring progress file for {t.dst_path.name}: {e}")
+
+        if t.size > 0:
+            step = -(-t.size // segments)
+            t.segments = [[start, min(start + step, t.size), 0] for start in range(0, t.size, step)]
+        else:
+            t.segments = [[0, None, 0]]
+
+        try:
+            f = open(t.part_path, 'wb')
+        except FileNotFoundError:
+            if not self.dirs: raise
+            # The folder was removed after it was cached
+            self.dirs.recreate(t.part_path.parent)
+            f = open(t.part_path, 'wb')
+        with f:
+            if t.size > 0:
+                try:
+                    os.posix_fallocate(f.fileno(), 0, t.size)
+                except (AttributeError, OSError):
+                    f.truncate(t.size)
+        t.save_control(force=True)
+
+    async def _fetch_all(self, t: _Transfer):
+        # Hash while streaming when the whole file arrives in order over one connection
+        hasher = hashlib.sha1() if t.sha1 and len(t.segments) == 1 and t.segments[0][2] == 0 else None
+
+        tasks = [asyncio.create_task(self._fetch_segment(t, seg, i, hasher)) for i, seg in enumerate(t.segments)]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks: task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            t.save_control(force=True)
+
+        if hasher:
+            t.digest = hasher.hexdigest()
+
+    async def _fetch_segment(self, t: _Transfer, seg: List[Optional[int]], index: int, hasher):
+        start, end = seg[0], seg[1]
+        attempts = 0
+        max_attempts = max(3, 2 * len(t.uris))
+        # Fails over to the next URI on errors
+        uri_index = 0
+
+        while end is None or seg[2] < end - start:
+            uri = t.uris[uri_index % len(t.uris)]
+            offset = start + seg[2]
+            headers = {}
+            if end is not None:
+                headers["Range"] = f"bytes={offset}-{end - 1}"
+            elif offset > 0:
+                headers["Range"] = f"bytes={offset}-"
+
+            try:
+                async with self.http.stream("GET", uri, headers=headers) as resp:
+                    resp.raise_for_status()
+                    if "Range" in headers and resp.status_code != 206:
+                        if offset > 0 or len(t.segments) > 1:
+                            raise RangeNotSupported()
+
+                    host = urlparse(str(resp.url)).netloc
+                    with open(t.part_path, 'r+b') as f:
+                        buffer = bytearray()
+                        async for chunk in resp.aiter_bytes():
+                            await self._bucket.take(len(chunk))
+                            buffer += chunk
+                            t.received[host] = t.received.get(host, 0) + len(chunk)
+                            if len(buffer) >= WRITE_SIZE:
+                                await self._write(t, f, seg, buffer, hasher)
+                                buffer = bytearray()
+                        if buffer:
+                            await self._write(t, f, seg, buffer, hasher)
+
+                if end is None: return
+
+            except (RangeNotSupported, asyncio.CancelledError):
+                raise
+            except Exception as e:
+                if self.scoreboard:
+                    self.scoreboard.record_error(urlparse(uri).netloc)
+                attempts += 1
+                if attempts >= max_attempts:
+                    raise Exception(f"Segment {index} failed after {attempts} attempts: {e}")
+                uri_index += 1
+                log.debug(f"Segment {index} of {t.dst_path.name} failed ({e}), retrying with {t.uris[uri_index % len(t.uris)]}")
+                await asyncio.sleep(min(0.5 * 2 ** attempts, 10))
+
+    async def _write(self, t: _Transfer, f, seg: List[Optional[int]], data: bytearray, hasher):
+        offset = seg[0] + seg[2]
+        if seg[1] is not None:
+            # Never write past the segment, even if the server sends more than asked
+            data = data[:seg[1] - offset]
+
+        def write():
+            f.seek(offset)
+            f.write(data)
+            if hasher: hasher.update(data)
+
+        await asyncio.to_thread(write)
+        seg[2] += len(data)
+        t.save_control()
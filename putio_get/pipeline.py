@@ -0,0 +1,484 @@
+import time
+import shutil
+import logging
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set
+
+from rich.progress import (
+    Progress,
+    TextColumn,
+    BarColumn,
+    TaskProgressColumn,
+    TimeRemainingColumn,
+    TransferSpeedColumn,
+    DownloadColumn
+)
+
+from . import metrics
+from .bandwidth import BandwidthManager
+from .config import Config
+from .client import PutioClient, FileRecord, url_expiry
+from .downloader import Downloader
+from .inventory import LocalInventory
+from .state import StateStore
+from .tuning import ThroughputTuner
+from .utils import DirectoryCache, apply_permissions_bulk, move_file, verify_sha1
+
+log = logging.getLogger("rich")
+
+# Completed files get their permissions together, then are marked synced, at least this often
+PERMISSIONS_INTERVAL = 10  # seconds
+PERMISSIONS_BATCH = 200  # files
+
+
+class Job:
+    """A single file moving through the pipeline. download_path differs from dest_path when staging."""
+    __slots__ = ("item", "dest_path", "download_path", "url", "expires", "gid", "task_id", "queued_at", "started_at", "bypass")
+
+    def __init__(self, item: FileRecord, dest_path: Path, url: Optional[str] = None, expires: float = 0.0,
+                 download_path: Optional[Path] = None):
+        self.item = item
+        self.dest_path = dest_path
+        self.download_path = download_path or dest_path
+        self.url = url
+        self.expires = expires
+        self.gid = None
+        self.task_id = None
+        self.queued_at = time.monotonic()
+        self.started_at = 0.0
+        self.bypass = False  # running in a small file slot, beyond max_concurrent
+
+
+class DownloadPipeline:
+    """
+    Runs a batch of files through six stages:
+      resolve  - destination path (worker pool)
+      verify   - SHA-1 check of files that already exist at the destination (worker pool)
+      url      - download URLs fetched ahead of the download queue (worker pool)
+      download - submission to the download engine, keeping up to max_concurrent transfers active,
+                 plus small files in their own slots when small_file_size is set
+      complete - moving staged files to the target, permissions and bookkeeping for the move action (worker pool)
+      progress - a single shared progress display for all active transfers
+    """
+
+    def __init__(self, config: Config, client: PutioClient, downloader: Downloader,
+                 exit_event: threading.Event, resolve_dest: Callable[[FileRecord], Path],
+                 state: Optional[StateStore] = None, tuner: Optional[ThroughputTuner] = None,
+                 dirs: Optional[DirectoryCache] = None, inventory: Optional[LocalInventory] = None,
+                 bandwidth: Optional[BandwidthManager] = None):
+        self.config = config
+        self.client = client
+        self.downloader = downloader
+        self.exit_event = exit_event
+        self.resolve_dest = resolve_dest
+        self.state = state
+        self.tuner = tuner
+        self.dirs = dirs
+        self.inventory = inventory
+        self.bandwidth = bandwidth
+        self.max_concurrent = tuner.concurrency if tuner else max(1, self.config.download['max_concurrent'])
+        self.poll_interval = 0.5
+        self.verify_workers = max(1, self.config.download['verify_workers'])
+        self.verify_block_size = self.config.download['verify_block_size_bytes']
+        self.verify_mmap = self.config.download['verify_mmap']
+        self.url_workers = max(1, self.config.download['url_workers'])
+        self.url_prefetch = max(1, self.config.download['url_prefetch'])
+        self.url_ttl = self.config.download['url_ttl']
+        # URLs this close to expiry are fetched again before they're handed to the engine
+        self.url_margin = min(300, self.url_ttl / 10)
+        self.staging = self.config.paths['staging']
+        self.staging_min_free = self.config.download['staging_min_free_bytes']
+        self.small_file_size = self.config.download['small_file_size_bytes']
+        self.small_slots = self.config.download['small_file_slots'] if self.small_file_size else 0
+
+        # Jobs with a URL waiting for a download slot. Small files queue on their own, so they can skip past large ones.
+        self.ready: "queue.Queue[Job]" = queue.Queue()
+        self.ready_small: "queue.Queue[Job]" = queue.Queue()
+        # Resolved files waiting for a URL, by whether they're small. A URL is only fetched while fewer than
+        # url_prefetch of the same kind are being fetched or ready, so fetch workers never wait on a full queue.
+        self._awaiting_url = {False: deque(), True: deque()}
+        self._fetching = {False: 0, True: 0}
+        self.processed_ids: List[int] = []
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._completing = 0
+        self._held: Optional[Job] = None  # next job, waiting for space in the staging directory
+        # Completed jobs waiting for their permissions, see _flush_completed
+        self._completed: List[Job] = []
+        self._flushed = time.monotonic()
+
+    def run(self, items: List[FileRecord]) -> List[int]:
+        """Processes all items and returns the IDs that completed and can be removed from put.io."""
+        self._resolver = ThreadPoolExecutor(max_workers=self.max_concurrent, thread_name_prefix="resolve")
+        self._verifier = ThreadPoolExecutor(max_workers=self.verify_workers, thread_name_prefix="verify")
+        self._fetcher = ThreadPoolExecutor(max_workers=self.url_workers, thread_name_prefix="url")
+        completers = max(1, self.config.download['mover_workers']) if self.staging else 2
+        self._completer = ThreadPoolExecutor(max_workers=completers, thread_name_prefix="complete")
+        active: Dict[str, Job] = {}
+
+        try:
+            for item in items:
+                self._submit(self._resolver, self._resolve, item)
+
+            with self._progress() as progress:
+                while not self.exit_event.is_set():
+                    self._admit(active, progress)
+                    self._fetch_ahead()
+                    self._flush_completed()
+
+                    # Tasks queue their job or their follow-up task before they count as done
+                    if not active and self._pending == 0 and not self._backlog() and not self._url_backlog() and not self._held:
+                        break
+
+                    # Returns early when a transfer stops or another stage has work here, see _wake
+                    self.downloader.wait(self.poll_interval)
+                    if active:
+                        self._poll(active, progress)
+        finally:
+            stopping = self.exit_event.is_set()
+            self._resolver.shutdown(wait=not stopping, cancel_futures=True)
+            self._verifier.shutdown(wait=not stopping, cancel_futures=True)
+            self._fetcher.shutdown(wait=not stopping, cancel_futures=True)
+            self._completer.shutdown(wait=True)
+            self._flush_completed(force=True)
+
+        return self.processed_ids
+
+    def _wake(self):
+        """
+        Wakes the main loop, which waits on the engine's stop signal, so a job that just
+        became ready is admitted and a finished run ends without waiting out a poll.
+        """
+        self.downloader.changed.set()
+
+    def _submit(self, pool: ThreadPoolExecutor, fn: Callable, *args):
+        """Runs fn in pool, tracking it as outstanding resolve work."""
+        def task():
+            try:
+                fn(*args)
+            finally:
+                with self._lock:
+                    self._pending -= 1
+                    done = self._pending == 0
+                if done: self._wake()
+
+        with self._lock:
+            self._pending += 1
+        try:
+            pool.submit(task)
+        except RuntimeError:
+            # Pool was shut down while stopping
+            with self._lock:
+                self._pending -= 1
+
+    def _progress(self) -> Progress:
+        return Progress(
+            TextColumn("[bold blue]{task.description}"),
+            BarColumn(),
+            TaskProgressColumn(),
+            DownloadColumn(),
+            TransferSpeedColumn(),
+            TimeRemainingColumn(),
+            transient=True,
+            refresh_per_second=2
+        )
+
+    # Resolve stage
+    def _resolve(self, item: FileRecord):
+        if self.exit_event.is_set(): return
+
+        try:
+            with metrics.timer("putio_resolve_seconds"):
+                if self.state and self.state.is_complete(item, self.inventory):
+                    log.debug(f"{item.name} is already synced. Skipping.")
+                    # Still on put.io, so a previous delete didn't go through
+                    if self.config.behavior['action'] == 'move':
+                        with self._lock:
+                            self.processed_ids.append(item.id)
+                    return
+
+                dest_path = self.resolve_dest(item)
+
+                exists = self.inventory.exists(dest_path) if self.inventory else dest_path.exists()
+            if item.sha1 and exists:
+                self._submit(self._verifier, self._verify, item, dest_path)
+            else:
+                self._request_url(item, dest_path)
+
+        except Exception as e:
+            log.error(f"Error processing {item.name}: {e}")
+
+    def _verify(self, item: FileRecord, dest_path: Path):
+        if self.exit_event.is_set(): return
+
+        log.info(f"File {dest_path.name} exists, verifying existing SHA-1...")
+        if verify_sha1(dest_path, item.sha1, self.state, self.verify_block_size, self.verify_mmap):
+            log.info(f"SHA-1 match for {dest_path.name}. Skipping download.")
+            self._finish(Job(item, dest_path))
+        else:
+            self._request_url(item, dest_path)
+
+    # URL stage
+    def _is_small(self, item: FileRecord) -> bool:
+        return bool(self.small_slots) and item.size <= self.small_file_size
+
+    def _request_url(self, item: FileRecord, dest_path: Path, first: bool = False):
+        """Queues a file for its download URL. first puts it ahead of the others, for URLs that expired."""
+        with self._lock:
+            waiting = self._awaiting_url[self._is_small(item)]
+            if first:
+                waiting.appendleft((item, dest_path))
+            else:
+                waiting.append((item, dest_path))
+        self._fetch_ahead()
+
+    def _fetch_ahead(self):
+        """Starts URL fetches for waiting files while their kind has fewer than url_prefetch in flight or ready."""
+        for small, ready in ((False, self.ready), (True, self.ready_small)):
+            while True:
+                with self._lock:
+                    waiting = self._awaiting_url[small]
+                    if not waiting or self._fetching[small] + ready.qsize() >= self.url_prefetch: break
+                    item, dest_path = waiting.popleft()
+                    self._fetching[small] += 1
+                self._submit(self._fetcher, self._enqueue, item, dest_path)
+
+    def _url_backlog(self) -> bool:
+        with self._lock:
+            return any(self._awaiting_url.values()) or any(self._fetching.values())
+
+    def _enqueue(self, item: FileRecord, dest_path: Path):
+        small = self._is_small(item)
+        try:
+            if self.exit_event.is_set(): return
+
+            with metrics.timer("putio_url_fetch_seconds"):
+                url = self.client.get_file_url(item.id)
+            if not url:
+                log.error(f"Could not get download URL for {item.name}")
+                return
+
+            job = Job(item, dest_path, url, url_expiry(url, self.url_ttl), self._staged_path(dest_path))
+            (self.ready_small if small else self.ready).put(job)
+            self._wake()
+
+        except Exception as e:
+            log.error(f"Error processing {item.name}: {e}")
+        finally:
+            with self._lock:
+                self._fetching[small] -= 1
+            # A failed fetch frees room for the next one
+            self._fetch_ahead()
+
+    def _staged_path(self, dest_path: Path) -> Optional[Path]:
+        """Returns where a file is downloaded in the staging directory, mirroring its place in the target."""
+        if not self.staging: return None
+        staged_path = self.staging / dest_path.relative_to(self.config.paths['target'])
+        staged_path.parent.mkdir(parents=True, exist_ok=True)
+        return staged_path
+
+    # Download stage
+    def _backlog(self) -> bool:
+        return not self.ready.empty() or not self.ready_small.empty()
+
+    def _next_job(self, active: Dict[str, Job]) -> Optional[Job]:
+        """The next job that has a free slot: regular slots take any file, small file slots only small ones."""
+        bypassing = sum(1 for job in active.values() if job.bypass)
+        regular = len(active) - bypassing < self.max_concurrent
+        small = bypassing < self.small_slots
+
+        job = self._held
+        if job:
+            if not regular and not (small and job.item.size <= self.small_file_size):
+                return None
+        else:
+            sources = ([self.ready] if regular else []) + ([self.ready_small] if regular or small else [])
+            for ready in sources:
+                try:
+                    job = ready.get_nowait()
+                    break
+                except queue.Empty:
+                    continue
+            if not job: return None
+
+        job.bypass = not regular
+        return job
+
+    def _admit(self, active: Dict[str, Job], progress: Progress):
+        while True:
+            job = self._next_job(active)
+            if not job: return
+
+            if job.download_path != job.dest_path and not self._has_room(job, active):
+                self._held = job
+                return
+            self._held = None
+
+            if job.expires - time.time() < self.url_margin:
+                log.debug(f"Download URL for {job.item.name} expired while queued, fetching a new one.")
+                self._request_url(job.item, job.dest_path, first=True)
+                continue
+
+            # Progress kept in a control file from an earlier run isn't this run's throughput
+            resumed = self.tuner and any(job.download_path.with_suffix(job.download_path.suffix + suffix).exists()
+                                         for suffix in (".aria2", ".putio"))
+            try:
+                job.gid = self._attach(job) or self.downloader.submit(job.url, job.download_path, job.item.size, job.item.sha1)
+            except Exception as e:
+                log.error(f"Download failed for {job.dest_path}: {e}")
+                continue
+
+            if self.tuner:
+                # The first download after an idle spell starts a new measurement window
+                if not active:
+                    self.tuner.reset()
+                self.tuner.started(job.gid, resumed)
+            job.started_at = time.monotonic()
+            metrics.observe("putio_queue_wait_seconds", job.started_at - job.queued_at)
+            if self.state:
+                self.state.record_transfer(job.item, job.gid, job.download_path)
+
+            job.task_id = progress.add_task(f"Downloading: {job.dest_path.name}", total=None)
+            active[job.gid] = job
+
+    def _has_room(self, job: Job, active: Dict[str, Job]) -> bool:
+        """
+        Whether the staging directory has space for a job. Engines preallocate, so free space
+        already accounts for active downloads, and staged files count until they are moved out.
+        """
+        try:
+            free = shutil.disk_usage(self.staging).free
+        except OSError as e:
+            log.warning(f"Could not check free space in {self.staging}: {e}")
+            return True
+
+        if free - job.item.size >= self.staging_min_free:
+            return True
+
+        if not active and not self._completing:
+            log.warning(f"Not enough space in {self.staging} for {job.dest_path.name}, downloading it to the target directly.")
+            job.download_path = job.dest_path
+            return True
+
+        if self._held is not job:
+            log.debug(f"Waiting for space in {self.staging} for {job.dest_path.name}")
+        return False
+
+    def _attach(self, job: Job) -> Optional[str]:
+        """Returns the GID of this item's download from before a restart, if the engine still has it."""
+        transfer = self.state.transfers().get(job.item.id) if self.state else None
+        if not transfer: return None
+
+        if transfer.dest_path != str(job.download_path):
+            # Destination changed since, the old partial file won't be used
+            self.downloader.discard(transfer.gid, Path(transfer.dest_path))
+            return None
+
+        if self.downloader.attach(transfer.gid, job.download_path):
+            log.info(f"Resuming unfinished download: {job.dest_path.name}")
+            return transfer.gid
+        return None
+
+    def _poll(self, active: Dict[str, Job], progress: Progress):
+        if self.bandwidth:
+            self.bandwidth.update()
+        statuses = self.downloader.status(list(active))
+        if self.tuner:
+            self.tuner.observe(statuses.values(), self._backlog())
+            self.max_concurrent = self.tuner.concurrency
+
+        for gid, st in statuses.items():
+            job = active[gid]
+
+            if st.status in ("active", "waiting", "paused"):
+                if st.total > 0:
+                    progress.update(job.task_id, total=st.total, completed=st.completed)
+                continue
+
+            del active[gid]
+            progress.remove_task(job.task_id)
+            metrics.observe("putio_download_seconds", time.monotonic() - job.started_at, result=st.status)
+
+            if st.status == "complete":
+                log.info(f"Download complete: {job.dest_path.name}")
+                metrics.inc("putio_downloaded_bytes_total", st.total)
+                self._finish(job)
+            elif st.status == "error":
+                log.error(f"Download error for {job.dest_path.name}: {st.error}")
+                self.downloader.cancel(gid)
+            else:
+                log.warning(f"Download removed externally: {job.dest_path.name}")
+
+    # Complete stage
+    def _finish(self, job: Job):
+        with self._lock:
+            self._completing += 1
+        self._completer.submit(self._complete, job)
+
+    def _complete(self, job: Job):
+        try:
+            if job.gid:
+                self.downloader.finish(job.gid, job.download_path)
+
+            if job.download_path != job.dest_path:
+                log.info(f"Moving {job.dest_path.name} to {job.dest_path.parent}")
+                with metrics.timer("putio_move_seconds"):
+                    try:
+                        move_file(job.download_path, job.dest_path)
+                    except FileNotFoundError:
+                        if not self.dirs or not job.download_path.exists(): raise
+                        # A target folder was removed after it was created
+                        self.dirs.recreate(job.dest_path.parent)
+                        move_file(job.download_path, job.dest_path)
+
+            if self.inventory:
+                self.inventory.add(job.dest_path)
+
+            with self._lock:
+                self._completed.append(job)
+
+        except Exception as e:
+            log.error(f"Error processing {job.item.name}: {e}")
+        finally:
+            with self._lock:
+                self._completing -= 1
+            # Frees space in the staging directory
+            self._wake()
+
+    def _flush_completed(self, force: bool = False):
+        """
+        Applies permissions to completed files, a directory listing at a time, then marks them synced.
+        Runs every PERMISSIONS_INTERVAL or PERMISSIONS_BATCH files, so a file is never recorded as
+        synced before it has its permissions. Files from a run cut short are checked again on the next one.
+        """
+        with self._lock:
+            if not self._completed: return
+            due = len(self._completed) >= PERMISSIONS_BATCH or time.monotonic() - self._flushed >= PERMISSIONS_INTERVAL
+            if not force and not due: return
+            jobs, self._completed = self._completed, []
+            self._flushed = time.monotonic()
+
+        files: Dict[Path, Set[str]] = {}
+        for job in jobs:
+            files.setdefault(job.dest_path.parent, set()).add(job.dest_path.name)
+        with metrics.timer("putio_permissions_seconds"):
+            apply_permissions_bulk(files,
+                self.config.permissions['target_uid'],
+                self.config.permissions['target_gid'],
+                self.config.permissions['target_fmode'])
+
+        for job in jobs:
+            try:
+                if self.state:
+                    self.state.mark_complete(job.item, job.dest_path)
+            except Exception as e:
+                log.error(f"Error processing {job.item.name}: {e}")
+                continue
+
+            if self.config.behavior['action'] == 'move':
+                with self._lock:
+                    self.processed_ids.append(job.item.id)
@@ -0,0 +1,113 @@
+import sys
+import time
+import pstats
+import logging
+import cProfile
+import threading
+from io import StringIO
+from pathlib import Path
+from typing import Callable, List
+
+from . import metrics
+
+log = logging.getLogger("rich")
+
+# Report rows, in the order a file goes through them. Phases run in parallel worker
+# threads, so their totals add up to more than the wall time of the run.
+PHASES = (
+    ("Listing", "putio_scan_seconds"),
+    ("API requests", "putio_api_request_seconds"),
+    ("Path resolution", "putio_resolve_seconds"),
+    ("Guessit", "putio_guessit_seconds"),
+    ("URL fetch", "putio_url_fetch_seconds"),
+    ("Slot wait", "putio_queue_wait_seconds"),
+    ("Download wait", "putio_download_seconds"),
+    ("Hashing", "putio_hash_seconds"),
+    ("Moves", "putio_move_seconds"),
+    ("Permissions", "putio_permissions_seconds"),
+)
+
+TOP_FUNCTIONS = 30
+
+
+class Profiler:
+    """
+    cProfile across every thread started while it runs, merged into one set of stats.
+    Before Python 3.12 a profiler only sees the thread that enabled it, so each new
+    thread gets its own through threading.setprofile.
+    """
+
+    def __init__(self):
+        self._main = cProfile.Profile()
+        self._threads: List[cProfile.Profile] = []
+        self._lock = threading.Lock()
+
+    def _start_thread(self, frame, event, arg):
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # 3.12+ profiles all threads from the main profiler already
+            return
+        with self._lock:
+            self._threads.append(profile)
+
+    def enable(self):
+        threading.setprofile(self._start_thread)
+        self._main.enable()
+
+    def disable(self) -> pstats.Stats:
+        self._main.disable()
+        threading.setprofile(None)
+        stats = pstats.Stats(self._main)
+        with self._lock:
+            for profile in self._threads:
+                profile.disable()
+                stats.add(profile)
+        return stats
+
+
+def run_profiled(run: Callable[[], None], path: Path):
+    """
+    Runs the given function under the profiler with metrics enabled, then writes the cProfile
+    stats to path and a report by phase next to it, with a .txt suffix.
+    """
+    registry = metrics.enable()
+    profiler = Profiler()
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        run()
+    finally:
+        stats = profiler.disable()
+        elapsed = time.perf_counter() - start
+
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        stats.dump_stats(path)
+        report = build_report(registry, stats, elapsed)
+        report_path = path.with_name(path.name + ".txt")
+        report_path.write_text(report)
+        print(report)
+        log.info(f"Profile written to {path}, report to {report_path}")
+
+
+def build_report(registry: metrics.Registry, stats: pstats.Stats, elapsed: float) -> str:
+    totals = {}
+    for name, _labels, count, seconds in registry.summary():
+        calls, total = totals.get(name, (0, 0.0))
+        totals[name] = (calls + count, total + seconds)
+
+    lines = [f"Wall time: {elapsed:.2f} s", "",
+             f"{'Phase':<18}{'Calls':>10}{'Total s':>12}{'Mean ms':>12}"]
+    for phase, name in PHASES:
+        calls, total = totals.get(name, (0, 0.0))
+        mean = f"{total / calls * 1000:.2f}" if calls else "-"
+        lines.append(f"{phase:<18}{calls:>10}{total:>12.2f}{mean:>12}")
+
+    out = StringIO()
+    stats.stream = out
+    stats.sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+    lines += ["", f"Top {TOP_FUNCTIONS} functions by cumulative time, all threads:", out.getvalue()]
+    return "\n".join(lines)
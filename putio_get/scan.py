@@ -0,0 +1,121 @@
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .client import FileRecord
+from .config import Config
+
+# target_root and the folder's path relative to it
+Placement = Optional[Tuple[Path, Tuple[str, ...]]]
+
+
+class ScanPlan:
+    """
+    Precompiled rules for turning put.io listings into sync items.
+
+    Sync mappings are compiled into a trie of path parts, allowed extensions into a
+    set, and the placement of each folder is computed once and cached, so each file
+    costs a dict lookup instead of a path walk and a loop over every mapping.
+    """
+
+    def __init__(self, config: Config):
+        self.target = config.paths['target']
+        self.allowed_extensions = frozenset(config.download['allowed_extensions'])
+        self.has_mappings = bool(config.paths['sync_mappings'])
+
+        # Each node is {part: node}, with the mapping at that depth stored under None
+        # as (priority, depth, target_root). Earlier mappings win, as in the config order.
+        self._trie: Dict = {}
+        for priority, (src_map, tgt_map) in enumerate(config.paths['sync_mappings'].items()):
+            node = self._trie
+            parts = Path(src_map).parts
+            for part in parts:
+                node = node.setdefault(part, {})
+            if None not in node:
+                node[None] = (priority, len(parts), self.target / tgt_map)
+
+        self._placements: Dict[int, Placement] = {}
+        self._paths: Dict[int, Tuple[str, ...]] = {}
+
+    def reset(self):
+        """Drops cached folder paths. Needed whenever folders may have moved or been renamed."""
+        self._placements.clear()
+        self._paths.clear()
+
+    def filter_items(self, items: Iterable[FileRecord], folders: Dict[int, FileRecord]) -> Dict[str, FileRecord]:
+        """
+        Keeps the files that match the allowed extensions and sync mappings,
+        and sets their relative path and target root.
+        Folders found in items are added to folders. Items can be a stream, since
+        files are only placed once every folder has been seen.
+        """
+        candidates: List[FileRecord] = []
+        allowed_extensions = self.allowed_extensions
+        for item in items:
+            if item.file_type == 'FOLDER':
+                folders[item.id] = item
+                continue
+
+            name = item.name
+            dot = name.rfind('.')
+            ext = name[dot:].lower() if dot >= 0 else ""
+            if ext in allowed_extensions:
+                candidates.append(item)
+
+        results = {}
+        for item in candidates:
+            placement = self._placements.get(item.parent_id, False)
+            if placement is False:
+                placement = self._place_folder(item.parent_id, folders)
+            if placement is None:
+                continue
+
+            target_root, rel_parts = placement
+            item.rel_path = Path(*rel_parts, item.name)
+            item.target_root = target_root
+            results[str(item.id)] = item
+
+        return results
+
+    def _folder_path(self, folder_id: int, folders: Dict[int, FileRecord]) -> Tuple[Tuple[str, ...], bool]:
+        """
+        Returns the full path parts of a folder, walking up only to the nearest cached ancestor,
+        and whether every ancestor was known. Unknown folders are treated as the root.
+        """
+        chain = []
+        current = folder_id
+        while current > 0 and current not in self._paths:
+            folder = folders.get(current)
+            if not folder: break
+            chain.append(folder)
+            current = folder.parent_id
+
+        complete = current <= 0 or current in self._paths
+        parts = self._paths.get(current, ())
+        for folder in reversed(chain):
+            parts = parts + (folder.name,)
+            if complete:
+                self._paths[folder.id] = parts
+
+        return parts, complete
+
+    def _place_folder(self, folder_id: int, folders: Dict[int, FileRecord]) -> Placement:
+        parts, complete = self._folder_path(folder_id, folders)
+
+        if not self.has_mappings:
+            placement = (self.target, parts)
+        else:
+            best = self._trie.get(None)
+            node = self._trie
+            for part in parts:
+                node = node.get(part)
+                if node is None: break
+                match = node.get(None)
+                if match and (best is None or match[0] < best[0]):
+                    best = match
+
+            placement = (best[2], parts[best[1]:]) if best else None
+
+        # Folders with unknown ancestors are resolved again once the tree is filled in
+        if complete:
+            self._placements[folder_id] = placement
+        return placement
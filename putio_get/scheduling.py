@@ -0,0 +1,116 @@
+import logging
+from collections import deque
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from .client import FileRecord
+from .config import Config
+
+log = logging.getLogger("rich")
+
+VIDEO_EXTENSIONS = frozenset({'.mkv', '.mp4', '.avi', '.mov', '.wmv', '.flv', '.webm'})
+SUBTITLE_EXTENSIONS = frozenset({'.srt', '.sub', '.sbv', '.vtt', '.ass'})
+
+# Sort keys, the first one listed in the schedule wins. put.io IDs grow over time,
+# so the highest IDs are the newest files.
+ORDERS: Dict[str, Callable[[FileRecord], object]] = {
+    'path': lambda item: str(item.rel_path),
+    'smallest': lambda item: item.size,
+    'newest': lambda item: -item.id,
+}
+MODIFIERS = ('subtitles', 'fair')
+
+
+class Scheduler:
+    """
+    Orders a batch of files for download from the schedule setting, a comma separated list of:
+      path, smallest, newest - sort order, ties broken by path
+      subtitles              - subtitles follow their video instead of being sorted on their own
+      fair                   - mapping roots take turns, each getting its weight in files per turn
+    Without fair, roots with a higher weight go first.
+    """
+
+    def __init__(self, config: Config):
+        names = [n.strip().lower() for n in config.download['schedule'].split(',') if n.strip()]
+        for name in names:
+            if name not in ORDERS and name not in MODIFIERS:
+                log.warning(f"Unknown schedule policy '{name}', ignoring it.")
+        self.orders = [ORDERS[n] for n in names if n in ORDERS] or [ORDERS['path']]
+        self.subtitles = 'subtitles' in names
+        self.fair = 'fair' in names
+
+        # Weights are given by mapping source, files only know their target root
+        self.weights: Dict[Path, int] = {}
+        mappings = config.paths['sync_mappings']
+        for pair in config.download['schedule_weights'].split(','):
+            if '=' not in pair: continue
+            source, weight = pair.rsplit('=', 1)
+            target = mappings.get(Path(source.strip().strip('/\\')))
+            if target is None:
+                log.warning(f"Schedule weight for '{source.strip()}', which is not a mapping source, is ignored.")
+                continue
+            try:
+                self.weights[config.paths['target'] / target] = max(1, int(weight))
+            except ValueError:
+                log.warning(f"Schedule weight '{weight.strip()}' for '{source.strip()}' is not a whole number, ignoring it.")
+
+    def _key(self, item: FileRecord):
+        return tuple(order(item) for order in self.orders) + (str(item.rel_path),)
+
+    def order(self, items: List[FileRecord]) -> List[FileRecord]:
+        # Units are downloaded back to back: a file, or a video and its subtitles
+        units = self._group(items)
+        units.sort(key=lambda unit: self._key(unit[0]))
+
+        if not self.fair:
+            if self.weights:
+                units.sort(key=lambda unit: -self._weight(unit[0]))
+            return [item for unit in units for item in unit]
+
+        roots: Dict[Path, deque] = {}
+        for unit in units:
+            roots.setdefault(unit[0].target_root, deque()).append(unit)
+        turn = sorted(roots, key=lambda root: (-self.weights.get(root, 1), str(root)))
+
+        ordered = []
+        while turn:
+            for root in list(turn):
+                pending = roots[root]
+                for _ in range(self.weights.get(root, 1)):
+                    if not pending: break
+                    ordered.extend(pending.popleft())
+                if not pending:
+                    turn.remove(root)
+        return ordered
+
+    def _weight(self, item: FileRecord) -> int:
+        return self.weights.get(item.target_root, 1)
+
+    def _group(self, items: List[FileRecord]) -> List[List[FileRecord]]:
+        if not self.subtitles:
+            return [[item] for item in items]
+
+        units: Dict[FileRecord, List[FileRecord]] = {}
+        videos: Dict[int, List[FileRecord]] = {}
+        subtitles = []
+        for item in items:
+            ext = Path(item.name).suffix.lower()
+            if ext in SUBTITLE_EXTENSIONS:
+                subtitles.append(item)
+                continue
+            units[item] = [item]
+            if ext in VIDEO_EXTENSIONS:
+                videos.setdefault(item.parent_id, []).append(item)
+
+        for sub in subtitles:
+            # The video with the longest name the subtitle's name starts with, e.g. Movie.mkv for Movie.en.srt
+            video = max((v for v in videos.get(sub.parent_id, ()) if sub.name.startswith(Path(v.name).stem)),
+                        key=lambda v: len(v.name), default=None)
+            if video:
+                units[video].append(sub)
+            else:
+                units[sub] = [sub]
+
+        for unit in units.values():
+            unit[1:] = sorted(unit[1:], key=lambda sub: sub.name)
+        return list(units.values())
@@ -0,0 +1,201 @@
+import os
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+from .client import FileRecord
+from .inventory import LocalInventory
+
+log = logging.getLogger("rich")
+
+
+class FileState(NamedTuple):
+    file_id: int
+    dest_path: str
+    size: int
+    sha1: str
+    mtime_ns: int
+    inode: int
+    state: str
+
+
+class Transfer(NamedTuple):
+    file_id: int
+    gid: str
+    dest_path: str
+
+
+class StateStore:
+    """
+    Persists per-file sync state in SQLite so restarts and daemon polls can skip
+    completed work without reading file contents.
+    File rows are cached in memory, lookups never touch the database.
+    It also caches the SHA-1 of local files, keyed by path, size, mtime and inode,
+    journals downloads in flight so they can be picked up again after a restart,
+    and keeps guessit names by source path.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                file_id INTEGER PRIMARY KEY,
+                dest_path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                sha1 TEXT,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                state TEXT NOT NULL
+            )
+        """)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS checksums (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                sha1 TEXT NOT NULL
+            )
+        """)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS transfers (
+                file_id INTEGER PRIMARY KEY,
+                gid TEXT NOT NULL,
+                dest_path TEXT NOT NULL
+            )
+        """)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS names (
+                source TEXT PRIMARY KEY,
+                version INTEGER NOT NULL,
+                name TEXT NOT NULL
+            )
+        """)
+        self._db.commit()
+
+        self._files: Dict[int, FileState] = {
+            row[0]: FileState(*row) for row in self._db.execute("SELECT * FROM files")
+        }
+        self._transfers: Dict[int, Transfer] = {
+            row[0]: Transfer(*row) for row in self._db.execute("SELECT * FROM transfers")
+        }
+        log.info(f"Loaded sync state for {len(self._files)} files from {path}")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def get(self, file_id: int) -> Optional[FileState]:
+        return self._files.get(file_id)
+
+    def is_complete(self, item: FileRecord, inventory: Optional[LocalInventory] = None) -> Optional[Path]:
+        """
+        Returns the destination of an item if it was already synced and the local
+        file is unchanged since, otherwise None. The local file is looked up in the
+        inventory when one is given.
+        """
+        record = self._files.get(item.id)
+        if not record or record.state != 'complete': return None
+        if record.size != item.size or (item.sha1 and record.sha1 != item.sha1):
+            return None
+
+        if inventory:
+            st = inventory.get(record.dest_path)
+            if not st: return None
+        else:
+            try:
+                st = os.stat(record.dest_path)
+            except OSError:
+                return None
+
+        if st.st_size != record.size or st.st_mtime_ns != record.mtime_ns or st.st_ino != record.inode:
+            return None
+
+        return Path(record.dest_path)
+
+    def mark_complete(self, item: FileRecord, dest_path: Path):
+        """Records a synced file along with the local file's identity."""
+        try:
+            st = os.stat(dest_path)
+        except OSError as e:
+            log.warning(f"Could not record sync state for {dest_path}: {e}")
+            return
+
+        record = FileState(item.id, str(dest_path), item.size, item.sha1 or "", st.st_mtime_ns, st.st_ino, 'complete')
+        with self._lock:
+            self._files[record.file_id] = record
+            self._db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)", record)
+            if record.sha1:
+                self._store_sha1(dest_path, st, record.sha1)
+            if self._transfers.pop(item.id, None):
+                self._db.execute("DELETE FROM transfers WHERE file_id = ?", (item.id,))
+            self._db.commit()
+
+    def transfers(self) -> Dict[int, Transfer]:
+        """Returns the downloads that were started but not yet recorded as complete."""
+        return dict(self._transfers)
+
+    def record_transfer(self, item: FileRecord, gid: str, dest_path: Path):
+        transfer = Transfer(item.id, gid, str(dest_path))
+        with self._lock:
+            self._transfers[item.id] = transfer
+            self._db.execute("INSERT OR REPLACE INTO transfers VALUES (?, ?, ?)", transfer)
+            self._db.commit()
+
+    def clear_transfer(self, file_id: int):
+        with self._lock:
+            if self._transfers.pop(file_id, None):
+                self._db.execute("DELETE FROM transfers WHERE file_id = ?", (file_id,))
+                self._db.commit()
+
+    def get_name(self, version: int, source: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT name FROM names WHERE source = ? AND version = ?", (source, version)
+            ).fetchone()
+        return row[0] if row else None
+
+    def get_names(self, version: int, sources: List[str]) -> Dict[str, str]:
+        names = {}
+        with self._lock:
+            for i in range(0, len(sources), 500):
+                chunk = sources[i:i + 500]
+                names.update(self._db.execute(
+                    f"SELECT source, name FROM names WHERE version = ? AND source IN ({','.join('?' * len(chunk))})",
+                    (version, *chunk)
+                ))
+        return names
+
+    def put_names(self, version: int, names: Dict[str, str]):
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO names VALUES (?, ?, ?)",
+                ((source, version, name) for source, name in names.items())
+            )
+            self._db.commit()
+
+    def cached_sha1(self, path: Path, st: os.stat_result) -> Optional[str]:
+        """Returns the SHA-1 recorded for this exact file, or None if it changed or was never hashed."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT sha1 FROM checksums WHERE path = ? AND size = ? AND mtime_ns = ? AND inode = ?",
+                (str(path), st.st_size, st.st_mtime_ns, st.st_ino)
+            ).fetchone()
+        return row[0] if row else None
+
+    def cache_sha1(self, path: Path, st: os.stat_result, sha1: str):
+        with self._lock:
+            self._store_sha1(path, st, sha1)
+            self._db.commit()
+
+    def _store_sha1(self, path: Path, st: os.stat_result, sha1: str):
+        self._db.execute(
+            "INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?, ?)",
+            (str(path), st.st_size, st.st_mtime_ns, st.st_ino, sha1.lower())
+        )
@@ -0,0 +1,149 @@
+import time
+import logging
+from typing import Dict, Iterable, Optional, Set
+
+from .config import Config
+from .downloader import Downloader, DownloadStatus
+
+log = logging.getLogger("rich")
+
+
+class ThroughputTuner:
+    """
+    Adjusts download concurrency and segments per download toward the highest aggregate throughput.
+
+    Every tune_interval one setting is raised one step. The step is kept while throughput
+    improves and undone once it stops improving, after which the other setting is tried.
+    Download errors halve concurrency. Both settings stay between 1 and their configured limits,
+    and segment changes only apply to downloads submitted afterwards.
+    """
+    TOLERANCE = 0.05  # throughput changes smaller than this are treated as noise
+    HOLD = 6  # intervals to wait after both settings failed to improve throughput
+
+    def __init__(self, config: Config, downloader: Downloader):
+        self.downloader = downloader
+        self.interval = config.download['tune_interval']
+        self.limits = {
+            'concurrency': max(1, config.download['max_concurrent_limit']),
+            'segments': max(1, config.download['max_segments_limit']),
+        }
+        self.values = {
+            'concurrency': max(1, min(config.download['max_concurrent'], self.limits['concurrency'])),
+            'segments': max(1, min(config.download['max_segments'], self.limits['segments'])),
+        }
+        self.knob = 'concurrency'
+
+        self._baseline: Optional[float] = None
+        self._last_move = None  # (knob, previous value)
+        self._completed: Dict[str, int] = {}
+        self._resumed: Set[str] = set()  # GIDs whose progress when first seen was made before this run
+        self._bytes = 0
+        self._errors = 0
+        self._misses = 0
+        self._hold = 0
+        self._window_start = time.monotonic()
+        self._apply()
+
+    @property
+    def concurrency(self) -> int:
+        return self.values['concurrency']
+
+    def reset(self):
+        """
+        Starts a new measurement window. Called when downloads start after an idle spell,
+        so the idle time doesn't count against the last step.
+        """
+        self._completed = {}
+        self._resumed.clear()
+        self._bytes = 0
+        self._errors = 0
+        self._window_start = time.monotonic()
+
+    def started(self, gid: str, resumed: bool = False):
+        """Registers a new download. Resumed ones only count what they transfer from their first poll on."""
+        if resumed:
+            self._resumed.add(gid)
+
+    def observe(self, statuses: Iterable[DownloadStatus], backlog: bool):
+        """
+        Counts the bytes transferred since the last poll. Backlog tells whether more files
+        are waiting for a slot, since more concurrency can't help otherwise.
+        """
+        completed = {}
+        for st in statuses:
+            completed[st.gid] = st.completed
+            # New downloads count from zero, even when they finished before their first poll
+            if st.gid in self._completed:
+                previous = self._completed[st.gid]
+            else:
+                previous = st.completed if st.gid in self._resumed else 0
+                self._resumed.discard(st.gid)
+            self._bytes += max(0, st.completed - previous)
+            if st.status == "error":
+                self._errors += 1
+        self._completed = completed
+
+        elapsed = time.monotonic() - self._window_start
+        if elapsed < self.interval: return
+
+        self._step(self._bytes / elapsed, backlog)
+        self._bytes = 0
+        self._errors = 0
+        self._window_start = time.monotonic()
+
+    def _step(self, throughput: float, backlog: bool):
+        rate = f"{throughput/1024/1024:.2f} MB/s"
+
+        if self._errors:
+            previous = self.values['concurrency']
+            self.values['concurrency'] = max(1, previous // 2)
+            self.knob = 'concurrency'
+            self._baseline, self._last_move = None, None
+            if self.values['concurrency'] != previous:
+                log.info(f"Auto-tune: {self._errors} download errors at {rate}, concurrency {previous} -> {self.concurrency}")
+                self._apply()
+            return
+
+        if self._baseline is not None and self._last_move:
+            if throughput > self._baseline * (1 + self.TOLERANCE):
+                self._misses = 0
+            else:
+                # No gain from the last step, undo it and try the other setting next
+                knob, previous = self._last_move
+                log.info(f"Auto-tune: no gain at {rate}, {knob} {self.values[knob]} -> {previous}")
+                self.values[knob] = previous
+                self._apply()
+                self.knob = 'segments' if knob == 'concurrency' else 'concurrency'
+                self._baseline, self._last_move = None, None
+                self._misses += 1
+                # Neither setting helped, stay put for a while before probing again
+                if self._misses >= 2:
+                    self._hold, self._misses = self.HOLD, 0
+                return
+
+        if self._hold:
+            self._hold -= 1
+            return
+
+        self._baseline = throughput
+        self._move(rate, backlog)
+
+    def _move(self, rate: str, backlog: bool):
+        for _ in range(2):
+            knob = self.knob
+            target = self.values[knob] + 1
+            # More slots only help when files are waiting for one
+            if target <= self.limits[knob] and (knob == 'segments' or backlog):
+                log.info(f"Auto-tune: {rate}, {knob} {self.values[knob]} -> {target}")
+                self._last_move = (knob, self.values[knob])
+                self.values[knob] = target
+                self._apply()
+                return
+            self.knob = 'segments' if knob == 'concurrency' else 'concurrency'
+
+        # Both settings are at a limit, hold until throughput changes
+        self._last_move = None
+
+    def _apply(self):
+        self.downloader.max_segments = self.values['segments']
+        self.downloader.set_concurrency(self.values['concurrency'] + self.downloader.bypass_slots)
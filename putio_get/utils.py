@@ -1,17 +1,21 @@
 import os
+import errno
 import hashlib
 import logging
 import json
+import mmap
 import re
+import shutil
+import stat
+import threading
+from collections import Counter
 from pathlib import Path
-from rich.console import Console
-from rich.logging import RichHandler
-from rich.traceback import install
+from typing import Dict, Iterable, Set
+
+from . import metrics
 
 # Configure Logging and output
 lib_loggers = ["guessit", "rebulk", "httpx", "httpcore"]
-install(show_locals=True, suppress=lib_loggers)
-console = Console()
 
 # Add TRACE level
 logging.addLevelName(5, "TRACE")
@@ -37,6 +41,11 @@ class TraceLabelFilter(logging.Filter):
 
 
 def setup_logging(log_level: str):
+    # rich is imported here rather than at module load, so commands that don't log start faster
+    from rich.logging import RichHandler
+    from rich.traceback import install
+    install(show_locals=True, suppress=lib_loggers)
+
     show_path = log_level in ("TRACE", "DEBUG")
     rich_handler = RichHandler(rich_tracebacks=True, markup=True, show_path=show_path)
     if log_level == "TRACE":
@@ -66,26 +75,187 @@ def sanitize_filename(name: str) -> str:
     return re.sub(r'[<>:"/\\|?*]', '', str(name))
 
 
+# Filesystem calls made for directories and permissions, reported in debug logs.
+# Counted from several worker threads without a lock, so the numbers are approximate.
+fs_calls = Counter()
+
+
+def _fix_permissions(path, st: os.stat_result, mode: int, uid: int, gid: int):
+    """Changes mode and ownership only where they differ from st."""
+    if stat.S_IMODE(st.st_mode) != mode:
+        fs_calls['chmod'] += 1
+        os.chmod(path, mode)
+    # os.chown is not available on Windows
+    if hasattr(os, 'chown') and (st.st_uid != uid or st.st_gid != gid):
+        fs_calls['chown'] += 1
+        os.chown(path, uid, gid)
+
+
 def apply_permissions(path: Path, is_file: bool, uid: int, gid: int, fmode: int, dmode: int):
-    """Applies configured ownership and permissions to a path."""
+    """Applies configured ownership and permissions to a path, skipping them if they already match."""
     mode = fmode if is_file else dmode
     try:
-        os.chmod(path, mode)
-        # os.chown is not available on Windows
-        if hasattr(os, 'chown'):
-            os.chown(path, uid, gid)
+        fs_calls['stat'] += 1
+        _fix_permissions(path, os.stat(path), mode, uid, gid)
     except Exception as e:
         log.warning(f"Could not set permissions on {str(path)}: {e}")
 
 
-def verify_sha1(path: Path, expected_sha1: str) -> bool:
-    """Verifies the SHA-1 checksum of a local file."""
+def apply_permissions_bulk(files: Dict[Path, Set[str]], uid: int, gid: int, fmode: int):
+    """
+    Applies configured file permissions to the given names in each directory,
+    listing each directory once with scandir instead of looking up every file.
+    """
+    for directory, names in files.items():
+        try:
+            fs_calls['scandir'] += 1
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name not in names: continue
+                    try:
+                        fs_calls['stat'] += 1
+                        _fix_permissions(entry.path, entry.stat(follow_symlinks=False), fmode, uid, gid)
+                    except Exception as e:
+                        log.warning(f"Could not set permissions on {entry.path}: {e}")
+        except OSError as e:
+            log.warning(f"Could not set permissions in {str(directory)}: {e}")
+
+
+class DirectoryCache:
+    """
+    Directories under root known to exist, so placing many files in one folder only
+    creates and checks it once. New directories get the configured permissions.
+    Call clear() when directories may have been removed since, or recreate() for one found missing.
+    """
+
+    def __init__(self, root: Path, uid: int, gid: int, fmode: int, dmode: int):
+        self.root = root
+        self.permissions = (uid, gid, fmode, dmode)
+        self._known: Set[Path] = {root}
+        self._lock = threading.Lock()
+
+    def ensure(self, path: Path):
+        path = path if path.is_absolute() else self.root / path
+
+        if path in self._known: return
+        if not path.is_relative_to(self.root):
+            raise ValueError("Path escapes target")
+
+        current = self.root
+        for part in path.relative_to(self.root).parts:
+            current /= part
+            if current in self._known: continue
+
+            # mkdir doubles as the existence check, one call per new directory
+            fs_calls['mkdir'] += 1
+            try:
+                current.mkdir()
+                log.info(f"Creating Directory: {str(current)}")
+                apply_permissions(current, False, *self.permissions)
+            except FileExistsError:
+                # Already there, or created by another resolver in the meantime
+                pass
+            with self._lock:
+                self._known.add(current)
+
+    def update(self, paths: Iterable[Path]):
+        """Adds directories known to exist, such as those found by a LocalInventory."""
+        with self._lock:
+            self._known.update(p for p in paths if p.is_relative_to(self.root))
+
+    def clear(self):
+        with self._lock:
+            self._known = {self.root}
+
+    def discard(self, path: Path):
+        """Forgets a directory and everything cached below it."""
+        with self._lock:
+            self._known = {p for p in self._known if p == self.root or not p.is_relative_to(path)}
+
+    def recreate(self, path: Path):
+        """Creates a cached directory again after it was removed, with the configured permissions."""
+        if not path.is_relative_to(self.root):
+            # Outside the target, e.g. in the staging directory
+            path.mkdir(parents=True, exist_ok=True)
+            return
+        # Any of its parents may be gone too
+        with self._lock:
+            self._known.difference_update(path.parents)
+            self._known.add(self.root)
+        self.discard(path)
+        self.ensure(path)
+
+
+def move_file(src: Path, dst: Path):
+    """
+    Moves a file, renaming it when both paths are on the same filesystem. Otherwise it is
+    copied next to the destination first, so dst never holds a partial copy.
+    """
+    try:
+        os.replace(src, dst)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV: raise
+
+    tmp_path = dst.with_suffix(dst.suffix + ".moving")
+    try:
+        shutil.copyfile(src, tmp_path)
+        os.replace(tmp_path, dst)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    src.unlink()
+
+
+def sha1_file(path: Path, block_size: int = 8 * 1024 * 1024, use_mmap: bool = False) -> str:
+    """
+    Returns the SHA-1 of a file. Reads go into one reused buffer of block_size bytes,
+    or through mmap, so large files are hashed without per-chunk allocations.
+    """
+    h = hashlib.sha1()
+    # Round up to whole pages so reads stay aligned
+    block_size = -(-max(block_size, mmap.PAGESIZE) // mmap.PAGESIZE) * mmap.PAGESIZE
+
+    with open(path, 'rb', buffering=0) as f:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+        if use_mmap and os.fstat(f.fileno()).st_size > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                if hasattr(m, 'madvise'):
+                    m.madvise(mmap.MADV_SEQUENTIAL)
+                with memoryview(m) as view:
+                    for offset in range(0, len(view), block_size):
+                        h.update(view[offset:offset + block_size])
+        else:
+            buffer = bytearray(block_size)
+            with memoryview(buffer) as view:
+                while True:
+                    n = f.readinto(buffer)
+                    if not n: break
+                    h.update(view[:n])
+
+    return h.hexdigest().lower()
+
+
+def verify_sha1(path: Path, expected_sha1: str, cache=None, block_size: int = 8 * 1024 * 1024, use_mmap: bool = False) -> bool:
+    """
+    Verifies the SHA-1 checksum of a local file.
+    If a cache (StateStore) is given, an unchanged file is only ever hashed once.
+    """
     try:
-        h = hashlib.sha1()
-        with open(path, 'rb') as f:
-            for chunk in iter(lambda: f.read(1024 * 1024), b""):
-                h.update(chunk)
-        return h.hexdigest().lower() == expected_sha1.lower()
+        st = os.stat(path)
+        actual = cache.cached_sha1(path, st) if cache else None
+        if actual:
+            log.debug(f"Using cached SHA-1 for {path.name}")
+            metrics.inc("putio_hash_cache_hits_total")
+        else:
+            with metrics.timer("putio_hash_seconds"):
+                actual = sha1_file(path, block_size, use_mmap)
+            metrics.inc("putio_hashed_bytes_total", st.st_size)
+            if cache:
+                cache.cache_sha1(path, st, actual)
+        return actual == expected_sha1.lower()
     except Exception as e:
         log.error(f"Error checking local SHA-1: {e}")
         return False